@@ -6,49 +6,533 @@
 
 # This implementation is a tiny subset of DNP.
 
-import crccheck
+from array import array
+import bisect
+import collections
 import socket
+import struct
 import sys
 import time
 
+# Application bytes per transport segment
+SEGMENT_SIZE = 249
+MAX_SEGMENTS = 64  # transport sequence numbers, segments of a fragment at most
+MAX_FRAGMENT = MAX_SEGMENTS * SEGMENT_SIZE  # application bytes of a fragment at most
+
 def dump_bytes(data):
     return ' '.join('{:02X}'.format(c) for c in data)
 
+def _make_crc_table():
+    # CRC-16/DNP: polynomial 0x3D65, reflected (0xA6BC)
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            if crc & 1:
+                crc = (crc >> 1) ^ 0xA6BC
+            else:
+                crc >>= 1
+        table.append(crc)
+    return tuple(table)
+
+_CRC_TABLE = _make_crc_table()
+_CRC_STRUCT = struct.Struct('<H')
+
+def crc16_dnp(data, start=0, end=None):
+    '''Calculate CRC-16/DNP of data[start:end]'''
+    if end is None:
+        end = len(data)
+    table = _CRC_TABLE
+    crc = 0
+    for i in range(start, end):
+        crc = (crc >> 8) ^ table[(crc ^ data[i]) & 0xff]
+    return crc ^ 0xffff
+
+# CRC register after a block followed by its CRC, see _blocks_ok()
+_CRC_RESIDUE = 0x66c5
+
+def little_endian(a):
+    '''Return the bytes of array (or typed memoryview) a in DNP (little endian) byte order'''
+    if sys.byteorder == 'big':
+        a = array(a.typecode if isinstance(a, array) else a.format, a)
+        a.byteswap()
+    return a.tobytes()
+
+def interleave(count, *columns):
+    '''Pack columns of fixed size fields into count records
+
+    Each column is a bytes-like object holding count fields. The records
+    are built with one strided slice assignment per byte of a record.
+    '''
+    sizes = [len(column) // count if count else 0 for column in columns]
+    stride = sum(sizes)
+    records = bytearray(count * stride)
+    offset = 0
+    for column, size in zip(columns, sizes):
+        for k in range(size):
+            records[offset + k::stride] = column[k::size]
+        offset += size
+    return records
+
+# Typecode of a 48bit DNP time field, milliseconds since 1970 UTC. Time
+# columns are arrays of 64bit integers ('q').
+TIME = 'T'
+
+def field_size(code):
+    return 6 if code == TIME else struct.calcsize(code)
+
+def dnp_time(seconds=None):
+    '''Return the DNP time of seconds since the epoch, or of now'''
+    if seconds is None:
+        seconds = time.time()
+    return int(round(seconds * 1000))
+
+def time_bytes(times):
+    '''Return DNP times as 48bit little endian fields'''
+    if not (isinstance(times, array) and times.typecode == 'q'):
+        times = array('q', times)
+    raw = little_endian(times)
+    data = bytearray(6 * len(times))
+    for k in range(6):
+        data[k::6] = raw[k::8]
+    return data
+
+def split_column(records, code, offset, size, stride, count):
+    '''Return the field at offset of count records as an array of code
+
+    The inverse of interleave(): one strided slice per field byte. TIME
+    fields are widened to 64bit integers.
+    '''
+    if code == TIME:
+        data = bytearray(8 * count)
+        for k in range(size):
+            data[k::8] = records[offset + k::stride]
+        code = 'q'
+    elif size == stride:
+        data = records
+    else:
+        data = bytearray(size * count)
+        for k in range(size):
+            data[k::size] = records[offset + k::stride]
+    column = array(code)
+    column.frombytes(data)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column
+
+# Byte with bit 7 set for every non-zero byte
+_STATE_BIT = bytes(bytearray([0] + [0x80] * 255))
+
+# State (bit 7) and flag bits of a binary point flag byte
+_FLAG_STATE = bytes(bytearray((b >> 7) & 0x1 for b in range(256)))
+_FLAG_BITS = bytes(bytearray(b & 0x3f for b in range(256)))
+
+# Bit b of every byte, as 0 or 1, and a state byte as bit b
+_BIT = [bytes(bytearray((c >> b) & 0x1 for c in range(256))) for b in range(8)]
+_STATE_AT = [bytes(bytearray([0] + [1 << b] * 255)) for b in range(8)]
+
+def state_bytes(values):
+    '''Return binary point states as bytes, one per point
+
+    values may be bytes, a bytearray, an array, a numpy bool or uint8
+    array or any sequence of numbers; a non-zero byte is a set point.
+    '''
+    try:
+        view = memoryview(values)
+    except TypeError:
+        return bytes(bytearray(1 if v else 0 for v in values))
+    if view.itemsize == 1:
+        return view.tobytes()
+    return bytes(bytearray(1 if v else 0 for v in values))
+
+def pack_binary_with_flag(values, flags):
+    '''Pack binary points as 8bit flag with state in bit 7 (1/2, 10/2)'''
+    count = len(flags)
+    state = state_bytes(values).translate(_STATE_BIT)
+    packed = int.from_bytes(state, 'little') | int.from_bytes(bytes(flags), 'little')
+    return packed.to_bytes(count, 'little')
+
+def pack_bits(values, count):
+    '''Pack count binary point states one bit per point (1/1, 10/1)
+
+    Point i is bit i % 8 of byte i // 8. Every eighth state is moved to
+    its bit with one translate, and the eight are OR-ed as integers.
+    '''
+    state = state_bytes(values)[:count]
+    size = (count + 7) // 8
+    packed = 0
+    for b in range(8):
+        packed |= int.from_bytes(state[b::8].translate(_STATE_AT[b]), 'little')
+    return packed.to_bytes(size, 'little')
+
+def unpack_bits(data, count):
+    '''Return count states packed one bit per point as an array of 0 and 1'''
+    data = bytes(data)
+    states = bytearray(len(data) * 8)
+    for b in range(8):
+        states[b::8] = data.translate(_BIT[b])
+    return array('B', states[:count])
+
+# struct format of the index prefix, by prefix code of the qualifier
+_PREFIX_FORMATS = {0: '', 1: 'B', 2: 'H', 3: 'I'}
+
+class DnpCodec(object):
+    '''Record layout of one object group and variation
+
+    fmt is the struct format of one point record after the index prefix
+    and fields names its items, among index, value, flag and time. With
+    state_in_flag the value is bit 7 of the flag (binary points); packed
+    objects are one bit per point with no flag. A TIME item is a 48bit
+    absolute time; a relative time is 16bit, milliseconds after the
+    common time of occurrence (group 51) before the object.
+    '''
+    def __init__(self, group, variation, label, fmt='', fields=(),
+                 state_in_flag=False, packed=False, relative=False):
+        self.group = group
+        self.variation = variation
+        self.label = label
+        self.fmt = fmt
+        self.fields = fields
+        self.state_in_flag = state_in_flag
+        self.packed = packed
+        self.relative = relative
+        self.layouts = {}
+
+        # Pretty-print format of a point
+        has_value = 'value' in fields or state_in_flag or packed
+        has_flag = 'flag' in fields
+        if has_value and has_flag:
+            self.point_format = '      ' + label + ' index {0.index}: {0.value} (flag=0x{0.flag:x})'
+        elif has_value:
+            self.point_format = '      ' + label + ' index {0.index}: {0.value}'
+        elif has_flag:
+            self.point_format = '      ' + label + ' index {0.index}: 0x{0.flag:x}'
+        elif 'time' in fields:
+            self.point_format = '      ' + label + ' {0.time}'
+            return
+        else:
+            self.point_format = '      index {0.index}'
+        if 'time' in fields:
+            self.point_format += ' at {0.time}'
+
+    def record_layout(self, prefix):
+        '''Return (size, fields) of a record with index prefix
+
+        fields lists (name, typecode, offset, size) of each item,
+        the index prefix first.
+        '''
+        layout = self.layouts.get(prefix)
+        if layout is None:
+            codes = _PREFIX_FORMATS[prefix] + self.fmt
+            names = ('index',) * len(_PREFIX_FORMATS[prefix]) + self.fields
+            fields = []
+            offset = 0
+            for name, code in zip(names, codes):
+                size = field_size(code)
+                fields.append((name, code, offset, size))
+                offset += size
+            layout = self.layouts[prefix] = (offset, fields)
+        return layout
+
+    def pack(self, count, columns):
+        '''Pack count records from columns, a dict of field name to values'''
+        if self.packed:
+            return pack_bits(columns['value'], count)
+        if self.state_in_flag:
+            flag = pack_binary_with_flag(columns['value'], columns['flag'])
+            if len(self.fields) == 1:
+                return flag
+            columns = dict(columns, flag=flag)
+        fields = []
+        for name, code in zip(self.fields, self.fmt):
+            column = columns[name]
+            if code == TIME:
+                fields.append(time_bytes(column))
+                continue
+            size = struct.calcsize(code)
+            if not (isinstance(column, (array, memoryview)) and column.itemsize == size):
+                column = array(code, column)
+            fields.append(little_endian(column))
+        return interleave(count, *fields)
+
+# Codecs by (group, variation)
+CODECS = {}
+
+def register_codec(group, variation, label, fmt='', fields=(), **kwargs):
+    CODECS[(group, variation)] = DnpCodec(group, variation, label, fmt, fields, **kwargs)
+
+register_codec(1, 0, 'BI')  # Index only
+register_codec(1, 1, 'BI', packed=True)  # Packed binary
+register_codec(1, 2, 'BI', 'B', ('flag',), state_in_flag=True)  # 8bit binary
+register_codec(2, 1, 'BI', 'B', ('flag',), state_in_flag=True)  # Event without time
+register_codec(2, 2, 'BI', 'BT', ('flag', 'time'), state_in_flag=True)  # Event with time
+register_codec(2, 3, 'BI', 'BH', ('flag', 'time'), state_in_flag=True,
+               relative=True)  # Event with relative time
+register_codec(10, 0, 'BO')  # Index only
+register_codec(10, 1, 'BO', packed=True)  # Packed output status
+register_codec(10, 2, 'BO', 'B', ('flag',), state_in_flag=True)  # 8bit output status
+register_codec(20, 0, 'CNT')  # Index only
+register_codec(20, 1, 'CNT', 'BI', ('flag', 'value'))  # 32bit with flag
+register_codec(20, 2, 'CNT', 'BH', ('flag', 'value'))  # 16bit with flag
+register_codec(20, 5, 'CNT', 'I', ('value',))  # 32bit value
+register_codec(20, 6, 'CNT', 'H', ('value',))  # 16bit value
+register_codec(30, 0, 'AI')  # Index only
+register_codec(30, 1, 'AI', 'Bi', ('flag', 'value'))  # 32bit with flag
+register_codec(30, 2, 'AI', 'Bh', ('flag', 'value'))  # 16bit with flag
+register_codec(30, 3, 'AI', 'i', ('value',))  # 32bit value
+register_codec(30, 4, 'AI', 'h', ('value',))  # 16bit value
+register_codec(30, 5, 'AI', 'Bf', ('flag', 'value'))  # Float with flag
+register_codec(30, 6, 'AI', 'Bd', ('flag', 'value'))  # Double with flag
+register_codec(32, 0, 'AI')  # Index only
+register_codec(32, 1, 'AI', 'Bi', ('flag', 'value'))  # 32bit event
+register_codec(32, 2, 'AI', 'Bh', ('flag', 'value'))  # 16bit event
+register_codec(32, 3, 'AI', 'BiT', ('flag', 'value', 'time'))  # 32bit event with time
+register_codec(32, 4, 'AI', 'BhT', ('flag', 'value', 'time'))  # 16bit event with time
+register_codec(32, 5, 'AI', 'Bf', ('flag', 'value'))  # Float event
+register_codec(32, 6, 'AI', 'Bd', ('flag', 'value'))  # Double event
+register_codec(32, 7, 'AI', 'BfT', ('flag', 'value', 'time'))  # Float event with time
+register_codec(32, 8, 'AI', 'BdT', ('flag', 'value', 'time'))  # Double event with time
+register_codec(34, 1, 'deadband', 'H', ('value',))  # 16bit value
+register_codec(34, 2, 'deadband', 'I', ('value',))  # 32bit value
+register_codec(34, 3, 'deadband', 'f', ('value',))  # Float value
+register_codec(40, 0, 'AO')  # Index only
+register_codec(40, 1, 'AO', 'Bi', ('flag', 'value'))  # 32bit with flag
+register_codec(40, 2, 'AO', 'Bh', ('flag', 'value'))  # 16bit with flag
+register_codec(40, 3, 'AO', 'Bf', ('flag', 'value'))  # Float with flag
+register_codec(40, 4, 'AO', 'Bd', ('flag', 'value'))  # Double with flag
+register_codec(41, 1, 'AO', 'iB', ('value', 'flag'))  # 32bit value and control flag
+register_codec(41, 2, 'AO', 'hB', ('value', 'flag'))  # 16bit value and control flag
+register_codec(41, 3, 'AO', 'fB', ('value', 'flag'))  # Float value and control flag
+register_codec(41, 4, 'AO', 'dB', ('value', 'flag'))  # Double value and control flag
+register_codec(42, 1, 'AO', 'Bi', ('flag', 'value'))  # 32bit event
+register_codec(42, 2, 'AO', 'Bh', ('flag', 'value'))  # 16bit event
+register_codec(42, 3, 'AO', 'BiT', ('flag', 'value', 'time'))  # 32bit event with time
+register_codec(42, 4, 'AO', 'BhT', ('flag', 'value', 'time'))  # 16bit event with time
+register_codec(42, 5, 'AO', 'Bf', ('flag', 'value'))  # Float event
+register_codec(42, 6, 'AO', 'Bd', ('flag', 'value'))  # Double event
+register_codec(50, 1, 'time', 'T', ('time',))  # Absolute time
+register_codec(50, 3, 'time', 'T', ('time',))  # Last recorded time
+register_codec(51, 1, 'CTO', 'T', ('time',))  # Common time of occurrence, synchronized
+register_codec(51, 2, 'CTO', 'T', ('time',))  # Common time of occurrence, unsynchronized
+
+# Objects of a READ request carry indices only, whatever the variation
+_INDEX_ONLY = DnpCodec(0, 0, '')
+
+class DnpError(Exception):
+    '''Base class of DnpSimple errors'''
+
+class DnpCrcError(DnpError):
+    '''Frame rejected for a bad header or payload CRC'''
+
+class DnpMetrics(object):
+    '''Counters, timers and latency histograms of DnpSimple
+
+    Instrumentation is off until enable_metrics() sets the module global
+    metrics to a DnpMetrics; each hook only tests it for None, so it
+    costs close to nothing when off. Metrics are keyed by name and an
+    optional label, a (key, value) pair such as ('outstation', 123).
+
+        metrics = DnpSimple.enable_metrics()
+        ...
+        print(metrics.export_text())
+    '''
+    # Upper bounds of the histogram buckets, in seconds
+    bounds = (0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02,
+              0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.counters = {}  # (name, label) -> count
+        self.timers = {}  # (name, label) -> [count, total seconds]
+        self.histograms = {}  # (name, label) -> [bucket counts, total seconds]
+
+    def count(self, name, label=None, n=1):
+        key = (name, label)
+        self.counters[key] = self.counters.get(key, 0) + n
+
+    def time(self, name, seconds, label=None):
+        timer = self.timers.get((name, label))
+        if timer is None:
+            timer = self.timers[(name, label)] = [0, 0.0]
+        timer[0] += 1
+        timer[1] += seconds
+
+    def observe(self, name, seconds, label=None):
+        histogram = self.histograms.get((name, label))
+        if histogram is None:
+            histogram = self.histograms[(name, label)] = [[0] * (len(self.bounds) + 1), 0.0]
+        histogram[0][bisect.bisect_left(self.bounds, seconds)] += 1
+        histogram[1] += seconds
+
+    def sent(self, data):
+        # Count data written to a socket or transport
+        self.count('sends')
+        self.count('bytes_sent', n=len(data))
+
+    def count_iin(self, iin):
+        for bit, name in _IIN_NAMES:
+            if iin & bit:
+                self.count('iin', ('flag', name))
+
+    def snapshot(self):
+        '''Return a copy of all metrics as plain dicts and lists'''
+        return {
+            'counters': dict(self.counters),
+            'timers': dict((key, {'count': count, 'seconds': total})
+                           for key, (count, total) in self.timers.items()),
+            'histograms': dict((key, {'bounds': self.bounds, 'counts': list(counts),
+                                      'seconds': total})
+                               for key, (counts, total) in self.histograms.items()),
+        }
+
+    def export_text(self):
+        '''Return all metrics in the Prometheus text format'''
+        def labels(label, *extra):
+            pairs = ([label] if label is not None else []) + list(extra)
+            if not pairs:
+                return ''
+            return '{' + ','.join('{}="{}"'.format(k, v) for k, v in pairs) + '}'
+        lines = []
+        for (name, label), count in sorted(self.counters.items(), key=str):
+            lines.append('dnp_{}{} {}'.format(name, labels(label), count))
+        for (name, label), (count, total) in sorted(self.timers.items(), key=str):
+            lines.append('dnp_{}_seconds_count{} {}'.format(name, labels(label), count))
+            lines.append('dnp_{}_seconds_sum{} {:.6f}'.format(name, labels(label), total))
+        for (name, label), (counts, total) in sorted(self.histograms.items(), key=str):
+            cumulative = 0
+            for bound, count in zip(self.bounds + ('+Inf',), counts):
+                cumulative += count
+                lines.append('dnp_{}_seconds_bucket{} {}'.format(
+                    name, labels(label, ('le', bound)), cumulative))
+            lines.append('dnp_{}_seconds_count{} {}'.format(name, labels(label), cumulative))
+            lines.append('dnp_{}_seconds_sum{} {:.6f}'.format(name, labels(label), total))
+        return '\n'.join(lines) + '\n'
+
+# Instrumentation, see DnpMetrics; None when off
+metrics = None
+
+def enable_metrics():
+    '''Turn instrumentation on and return the DnpMetrics'''
+    global metrics
+    if metrics is None:
+        metrics = DnpMetrics()
+    return metrics
+
+def disable_metrics():
+    global metrics
+    metrics = None
+
+class DnpDecodeCache(object):
+    '''Bounded LRU of decoded objects, keyed by the bytes they came from
+
+    Integrity and static polls mostly return the same points again. With
+    the cache on, DnpDisasm.objects looks up the object bytes of the
+    packet, CRCs stripped, and returns the objects decoded last time
+    instead of decoding them again. Objects are then shared between
+    packets and must be treated as read only.
+    '''
+    def __init__(self, size=256):
+        self.size = size
+        self.entries = collections.OrderedDict()  # key -> objects
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        objects = self.entries.get(key)
+        if objects is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return objects
+
+    def put(self, key, objects):
+        self.entries[key] = objects
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+decode_cache = None
+
+def enable_decode_cache(size=256):
+    '''Turn the decode cache on and return the DnpDecodeCache'''
+    global decode_cache
+    if decode_cache is None:
+        decode_cache = DnpDecodeCache(size)
+    return decode_cache
+
+def disable_decode_cache():
+    global decode_cache
+    decode_cache = None
+
 class DnpAsm(object):
     '''Assemble DNP packet'''
     def __init__(self):
         self.data = bytearray()
+        self.transport_seq = 0
 
-    def makePrologue(self, src, dst, function):
+    def makePrologue(self, src, dst, function, seq=0, con=0, uns=0, fir=1, fin=1):
         self.link_header(src, dst)
         self.transport_header(1, 1, 0)
-        self.application_header(1, 1, 0, 0, 0, function)
+        self.application_header(fir, fin, con, uns, seq, function)
 
     def makeEpilogue(self):
-        # Calculate link_len
-        self.data[2] = len(self.data) - 3  # exclude link_start, link_length
-
-        # Calculate link header CRC
-        crc = crccheck.crc.Crc16Dnp()
-        crc.process(self.data[0:8])
-        value = crc.final()
-        self.data.insert(8, value >> 8)
-        self.data.insert(8, value & 0xff)
-
-        # Calculate payload CRC
-        p = 10
-        while len(self.data) - p > 0:
-            length = len(self.data) - p
-            if length > 16:
-                length = 16
-            
-            crc = crccheck.crc.Crc16Dnp()
-            crc.process(self.data[p:p+length])
-            value = crc.final()
-            p += length
-            self.data.insert(p, value >> 8)
-            self.data.insert(p, value & 0xff)
-            p += 2
+        # Split application data into transport segments, each in its own
+        # link frame of up to 250 user data bytes (transport header + 249)
+        m = metrics
+        if m is not None:
+            started = time.perf_counter()
+        data = self.data
+        length = len(data)
+        src = memoryview(data)
+        sizes = [min(SEGMENT_SIZE, length - p)
+                 for p in range(9, length, SEGMENT_SIZE)] or [0]
+        if len(sizes) > MAX_SEGMENTS:
+            raise DnpError('fragment of {} bytes takes more than {} segments'.format(
+                length - 9, MAX_SEGMENTS))
+
+        # Build all frames in one pass: link header, then each 16 byte
+        # payload block followed by its CRC
+        frame = bytearray(sum(frame_length(n + 6) for n in sizes))
+        seq = self.transport_seq
+        last = len(sizes) - 1
+        p = 9
+        q = 0
+        for i, n in enumerate(sizes):
+            frame[q:q + 8] = src[0:8]
+            frame[q + 2] = n + 6  # exclude link_start, link_length
+            _CRC_STRUCT.pack_into(frame, q + 8, crc16_dnp(frame, q, q + 8))
+            q += 10
+
+            # Transport header is the first byte of the first block
+            frame[q] = seq | ((i == last) << 7) | ((i == 0) << 6)
+            start = q
+            q += 1
+            end = p + n
+            while True:
+                block = min(start + 16 - q, end - p)
+                frame[q:q + block] = src[p:p + block]
+                p += block
+                q += block
+                _CRC_STRUCT.pack_into(frame, q, crc16_dnp(frame, start, q))
+                q += 2
+                if p >= end:
+                    break
+                start = q
+            seq = (seq + 1) & 0x3f
+        self.transport_seq = seq
+        self.data = frame
+        if m is not None:
+            m.time('encode', time.perf_counter() - started)
+            m.count('frames_built', n=len(sizes))
+            m.count('bytes_built', n=len(frame))
 
     def link_start(self):
         self.data +=bytearray.fromhex('05 64')
@@ -79,14 +563,25 @@ class DnpAsm(object):
     def link_length(self, length):
         self.data += bytearray((length,))
 
-    def link_header(self, src, dst):
+    def link_header(self, src, dst, function=4, dir=1, prm=1, fcb=0, fcv=0):
+        # function 4: LINK_UNCONFIRMED_USER_DATA, see LinkFunction
         self.link_start()
         self.link_length(0)
-        self.link_control(1, 1, 0, 0, 4)  # 4: LINK_UNCONFIRMED_USER_DATA
+        self.link_control(dir, prm, fcb, fcv, function)
         self.link_destination(dst)
         self.link_source(src)
 
+    @staticmethod
+    def link_frame(src, dst, function, dir=1, prm=1, fcb=0, fcv=0):
+        # Header only frame, such as RESET_LINK_STATES or ACK
+        req = DnpAsm()
+        req.link_header(src, dst, function, dir, prm, fcb, fcv)
+        req.data[2] = 5  # control, destination, source
+        req.link_crc(crc16_dnp(req.data))
+        return req.data;
+
     def transport_header(self, fin, fir, seq):
+        # Placeholder, makeEpilogue writes the header of each segment
         ctrl = seq
         ctrl |= fin << 7
         ctrl |= fir << 6
@@ -118,91 +613,183 @@ class DnpAsm(object):
         v3 = (v >> 24) & 0xff
         self.data += bytearray((v0, v1, v2, v3))
 
+    def object_time(self, t):
+        self.data += time_bytes((t,))
+
+    def object_cto(self, t, synchronized=True):
+        '''Append a common time of occurrence for relative times after it'''
+        self.object_header(51, 1 if synchronized else 2, 0x07)  # 1-octet count
+        self.object_value1(1)
+        self.object_time(t)
+
+    def object_range_header(self, group, variation, start, stop):
+        if stop <= 0xff:
+            self.object_header(group, variation, 0x00)  # 1-octet start, stop
+            self.object_value1(start)
+            self.object_value1(stop)
+        else:
+            self.object_header(group, variation, 0x01)  # 2-octet start, stop
+            self.object_value2(start)
+            self.object_value2(stop)
+
+    def object_block(self, group, variation, records, count, start=0, indices=None):
+        '''Append count packed records, for points start.. or for indices'''
+        if indices is None:
+            self.object_range_header(group, variation, start, start + count - 1)
+            self.data += records
+        else:
+            self.object_header(group, variation, 0x28)  # 2-octet index, count
+            self.object_value2(count)
+            self.data += interleave(count, little_endian(array('H', indices)), records)
+
+    def object_points(self, group, variation, start=0, indices=None, **columns):
+        '''Append points packed by the codec of group and variation
+
+        columns are the value, flag (...) columns of the codec fields,
+        for points start.. or for indices.
+        '''
+        codec = CODECS[(group, variation)]
+        if codec.packed and indices is not None:
+            raise DnpError('packed objects take a range, not indices')
+        count = len(indices) if indices is not None else len(next(iter(columns.values())))
+        self.object_block(group, variation, codec.pack(count, columns),
+                          count, start, indices)
+
     @staticmethod
-    def request_class(src, dst, cls):
-        function = 1  # READ
+    def request_class(src, dst, cls, seq=0):
         group = 60  # all
         variation = cls + 1  # variation 0 means class 1 poll
-        qualifier = 6  # no range, requesting all values
-
-        req = DnpAsm()
-        req.makePrologue(src, dst, function)
-
-        req.object_header(group, variation, qualifier)
 
-        req.makeEpilogue()
-        return req.data;
+        # No range, requesting all values; built from a cached template
+        req = DnpRequest(src, dst)
+        req.read(group, variation)
+        return req.build(seq)
 
     @staticmethod
-    def request_confirm(src, dst, cls):
+    def request_confirm(src, dst, cls, seq=0, uns=0):
         function = 0  # CONFIRM
 
+        # uns confirms an unsolicited response
         req = DnpAsm()
-        req.makePrologue(src, dst, function)
+        req.makePrologue(src, dst, function, seq, uns=uns)
         req.makeEpilogue()
         return req.data;
 
     @staticmethod
-    def request_analog_in(src, dst, index):
-        function = 1  # READ
+    def request_unsolicited(src, dst, classes, enable=True, seq=0):
+        function = 0x14 if enable else 0x15  # ENABLE/DISABLE_UNSOLICITED
+
+        # Event classes 1-3, no range; built from a cached template
+        req = DnpRequest(src, dst, function)
+        req.read_class(*classes)
+        return req.build(seq)
+
+    @staticmethod
+    def request_analog_in(src, dst, index, seq=0):
         group = 30  # analog input
         variation = 0  # unspecified
+
+        # With 2-octet index, 2-octet count; built from a cached template
+        req = DnpRequest(src, dst)
+        req.read(group, variation, indices=(index,))
+        return req.build(seq)
+
+    @staticmethod
+    def request_analog_out_status(src, dst, index, seq=0):
+        group = 40  # analog output status
+        variation = 0  # unspecified
+
+        # With 2-octet index, 2-octet count; built from a cached template
+        req = DnpRequest(src, dst)
+        req.read(group, variation, indices=(index,))
+        return req.build(seq)
+
+    @staticmethod
+    def request_binary_in(src, dst, index, seq=0):
+        group = 1  # binary input
+        variation = 0  # unspecified
+
+        # With 2-octet index, 2-octet count; built from a cached template
+        req = DnpRequest(src, dst)
+        req.read(group, variation, indices=(index,))
+        return req.build(seq)
+
+    @staticmethod
+    def request_analog_out(src, dst, index, value, seq=0):
+        function = 5  # APPLICATION_DIRECT_OPERATE
+        group = 41  # analog output
+        variation = 1  # 32bit value and control status
         qualifier = 0x28  # with 2-octet index, 2-octet count
 
         req = DnpAsm()
-        req.makePrologue(src, dst, function)
+        req.makePrologue(src, dst, function, seq)
 
         req.object_header(group, variation, qualifier)
         req.object_value2(1)  # count
-        req.object_value2(index)  # index
+        req.object_value2(index)
+        req.object_value4(value)
+        req.object_value1(0)  # control
 
         req.makeEpilogue()
         return req.data;
 
     @staticmethod
-    def request_analog_out_status(src, dst, index):
-        function = 1  # READ
-        group = 40  # analog output status
-        variation = 0  # unspecified
+    def request_deadband(src, dst, index, value, seq=0):
+        function = 2  # WRITE
+        group = 34  # analog input deadband
+        variation = 2  # 32bit value
         qualifier = 0x28  # with 2-octet index, 2-octet count
 
         req = DnpAsm()
-        req.makePrologue(src, dst, function)
+        req.makePrologue(src, dst, function, seq)
 
         req.object_header(group, variation, qualifier)
         req.object_value2(1)  # count
-        req.object_value2(index)  # index
+        req.object_value2(index)
+        req.object_value4(value)
 
         req.makeEpilogue()
         return req.data;
 
     @staticmethod
-    def request_binary_in(src, dst, index):
-        function = 1  # READ
-        group = 1  # binary input
-        variation = 0  # unspecified
-        qualifier = 0x28  # with 2-octet index, 2-octet count
+    def request_record_current_time(src, dst, seq=0):
+        function = 0x18  # RECORD_CURRENT_TIME
+
+        # No object, the outstation notes its time at the end of the request
+        req = DnpAsm()
+        req.makePrologue(src, dst, function, seq)
+        req.makeEpilogue()
+        return req.data;
+
+    @staticmethod
+    def request_time(src, dst, t, variation=3, seq=0):
+        function = 2  # WRITE
+        group = 50  # time and date
+        qualifier = 0x07  # 1-octet count
 
+        # variation 1 sets the time to t, variation 3 (last recorded
+        # time) to t plus the time since RECORD_CURRENT_TIME
         req = DnpAsm()
-        req.makePrologue(src, dst, function)
+        req.makePrologue(src, dst, function, seq)
 
         req.object_header(group, variation, qualifier)
-        req.object_value2(1)  # count
-        req.object_value2(index)  # index
+        req.object_value1(1)  # count
+        req.object_time(t)
 
         req.makeEpilogue()
         return req.data;
 
     @staticmethod
-    def request_analog_out(src, dst, index, value):
-        function = 5  # APPLICATION_DIRECT_OPERATE
+    def response_analog_out(src, dst, index, value, seq=0):
+        function = 129  # RESPONSE
         group = 41  # analog output
         variation = 1  # 32bit value and control status
         qualifier = 0x28  # with 2-octet index, 2-octet count
 
         req = DnpAsm()
-        req.makePrologue(src, dst, function)
+        req.makePrologue(src, dst, function, seq)
 
+        req.object_value2(0)  # iin
         req.object_header(group, variation, qualifier)
         req.object_value2(1)  # count
         req.object_value2(index)
@@ -213,88 +800,503 @@ class DnpAsm(object):
         return req.data;
 
     @staticmethod
-    def response_analog_out(src, dst, index, value):
+    def response_analog_out_status(src, dst, index, value, seq=0):
         function = 129  # RESPONSE
-        group = 41  # analog output
+        group = 40  # analog output status
         variation = 1  # 32bit value and control status
         qualifier = 0x28  # with 2-octet index, 2-octet count
 
         req = DnpAsm()
-        req.makePrologue(src, dst, function)
+        req.makePrologue(src, dst, function, seq)
 
         req.object_value2(0)  # iin
         req.object_header(group, variation, qualifier)
         req.object_value2(1)  # count
         req.object_value2(index)
+        req.object_value1(0)  # flag
         req.object_value4(value)
-        req.object_value1(0)  # control
 
         req.makeEpilogue()
         return req.data;
 
     @staticmethod
-    def response_analog_out_status(src, dst, index, value):
+    def response_binary_in_range(src, dst, start, values, flags, seq=0):
+        function = 129  # RESPONSE
+        group = 1  # binary input
+        variation = 2  # 8bit flag with state
+
+        req = DnpAsm()
+        req.makePrologue(src, dst, function, seq)
+
+        req.object_value2(0)  # iin
+        req.object_points(group, variation, start, value=values, flag=flags)
+
+        req.makeEpilogue()
+        return req.data;
+
+    @staticmethod
+    def response_binary_in_packed(src, dst, start, values, seq=0):
+        function = 129  # RESPONSE
+        group = 1  # binary input
+        variation = 1  # packed, one bit per point
+
+        req = DnpAsm()
+        req.makePrologue(src, dst, function, seq)
+
+        req.object_value2(0)  # iin
+        req.object_points(group, variation, start, value=values)
+
+        req.makeEpilogue()
+        return req.data;
+
+    @staticmethod
+    def response_analog_in_range(src, dst, start, values, flags, seq=0):
+        function = 129  # RESPONSE
+        group = 30  # analog input
+        variation = 1  # 32bit with flag
+
+        req = DnpAsm()
+        req.makePrologue(src, dst, function, seq)
+
+        req.object_value2(0)  # iin
+        req.object_points(group, variation, start, value=values, flag=flags)
+
+        req.makeEpilogue()
+        return req.data;
+
+    @staticmethod
+    def response_analog_out_status_range(src, dst, start, values, flags, seq=0):
         function = 129  # RESPONSE
         group = 40  # analog output status
-        variation = 1  # 32bit value and control status
-        qualifier = 0x28  # with 2-octet index, 2-octet count
+        variation = 1  # 32bit with flag
 
         req = DnpAsm()
-        req.makePrologue(src, dst, function)
+        req.makePrologue(src, dst, function, seq)
 
         req.object_value2(0)  # iin
-        req.object_header(group, variation, qualifier)
-        req.object_value2(1)  # count
-        req.object_value2(index)
-        req.object_value1(0)  # flag
-        req.object_value4(value)
+        req.object_points(group, variation, start, value=values, flag=flags)
 
         req.makeEpilogue()
         return req.data;
 
+class DnpRequest(object):
+    '''Build one request fragment with many object headers
+
+        build = (DnpRequest(0, 123)
+                 .read(30, 0, start=0, stop=99)
+                 .read(1, 0, indices=[3, 7])
+                 .read_class(1, 2, 3)
+                 .build)
+        frame = build(seq)
+
+    Built frames are cached as templates keyed by (src, dst, function,
+    object headers), so building the same request again only copies the
+    template and patches the sequence number and the first block CRC.
+    '''
+    templates = {}
+    max_templates = 1024
+
+    def __init__(self, src, dst, function=1):  # READ
+        self.src = src
+        self.dst = dst
+        self.function = function
+        self.headers = []
+
+    def read(self, group, variation=0, start=None, stop=None, indices=None):
+        '''Add points start..stop (stop defaults to start), points at indices, or all points'''
+        if indices is not None:
+            self.headers.append((group, variation, tuple(indices)))
+        elif start is not None:
+            if stop is None:
+                stop = start
+            self.headers.append((group, variation, start, stop))
+        else:
+            self.headers.append((group, variation))
+        return self
+
+    def read_class(self, *classes):
+        '''Add class polls, class 0 being every static point'''
+        for cls in classes:
+            self.headers.append((60, cls + 1))
+        return self
+
+    def template(self):
+        key = (self.src, self.dst, self.function, tuple(self.headers))
+        template = DnpRequest.templates.get(key)
+        if template is None:
+            req = DnpAsm()
+            req.makePrologue(self.src, self.dst, self.function)
+            for header in self.headers:
+                if len(header) == 2:
+                    req.object_header(header[0], header[1], 0x06)  # all values
+                elif len(header) == 3:
+                    req.object_header(header[0], header[1], 0x28)  # 2-octet index, count
+                    req.object_value2(len(header[2]))
+                    for index in header[2]:
+                        req.object_value2(index)
+                else:
+                    req.object_range_header(*header)
+            req.makeEpilogue()
+            if len(DnpRequest.templates) >= DnpRequest.max_templates:
+                DnpRequest.templates.clear()
+            template = DnpRequest.templates[key] = bytes(req.data)
+        return template
+
+    def build(self, seq=0):
+        '''Return the request frames with application sequence seq'''
+        frame = bytearray(self.template())
+        if seq:
+            # Application control is in the first payload block
+            frame[11] |= seq & 0x0f
+            end = 10 + min(16, frame[2] - 5)
+            _CRC_STRUCT.pack_into(frame, end, crc16_dnp(frame, 10, end))
+        return frame
+
+_U16 = struct.Struct('<H')
+_U32 = struct.Struct('<I')
+_U48 = struct.Struct('<IH')
+_LINK_HEADER = struct.Struct('<HBBHHH')
+
+def set_link_control(frame, control, offset=0):
+    '''Change the link control byte of the frame at offset, and its header CRC'''
+    frame[offset + 3] = control
+    _CRC_STRUCT.pack_into(frame, offset + 8, crc16_dnp(frame, offset, offset + 8))
+
+def frame_length(link_length):
+    '''Return total bytes of a link frame, CRCs included, for link_length'''
+    user = link_length - 5  # exclude control, destination, source
+    return 10 + user + ((user + 15) // 16) * 2
+
+def _blocks_ok(view, p, end, size):
+    # Check the CRC of each block from p to end, the first one size bytes
+    # and the rest 18 bytes, CRC included. Running the CRC over a block
+    # followed by its own CRC leaves a constant residue.
+    table = _CRC_TABLE
+    while p < end:
+        q = min(p + size, end)
+        crc = 0
+        for c in view[p:q]:
+            crc = (crc >> 8) ^ table[(crc ^ c) & 0xff]
+        if crc != _CRC_RESIDUE:
+            return False
+        p = q
+        size = 18
+    return True
+
+def verify_frame(data, offset=0):
+    '''Return True if the frame at offset has a good header and payload CRCs'''
+    view = memoryview(data)
+    if len(view) - offset < 10 or view[offset] != 0x05 or view[offset + 1] != 0x64:
+        return False
+    length = frame_length(view[offset + 2])
+    if view[offset + 2] < 5 or len(view) - offset < length:
+        return False
+    return _blocks_ok(view, offset, offset + length, 10)
+
+def validate_frames(data):
+    '''Validate many back-to-back link frames in one call
+
+    data is a buffer supporting find(), such as bytes, bytearray or mmap.
+    Return (offsets, bad): the offset of each frame whose CRCs are all
+    good, and the number of frames rejected. Bytes that cannot be
+    delimited as a frame are skipped up to the next 0x05 0x64.
+    '''
+    view = memoryview(data)
+    total = len(view)
+    offsets = []
+    bad = 0
+    p = 0
+    while p + 10 <= total:
+        if view[p] != 0x05 or view[p + 1] != 0x64:
+            p = data.find(b'\x05\x64', p + 1)
+            if p < 0:
+                break
+            continue
+        length = frame_length(view[p + 2])
+        if view[p + 2] < 5 or not _blocks_ok(view, p, p + 10, 10):
+            # Without a good header the frame length is unknown
+            bad += 1
+            p += 1
+            continue
+        if p + length > total:
+            bad += 1
+            break
+        if _blocks_ok(view, p + 10, p + length, 18):
+            offsets.append(p)
+        else:
+            bad += 1
+        p += length
+    return offsets, bad
+
+class DnpFramer(object):
+    '''Split a received byte stream into link frames
+
+    Bytes are kept in a fixed ring buffer of size bytes (a power of two).
+    Use feed() with chunks of any size, or recv() (or buffer() and
+    commit()) to receive straight into the ring and then frames(). Each complete frame is yielded as a
+    new bytearray. Garbage and headers with a bad CRC are skipped up to
+    the next 0x05 0x64 and counted in self.discarded.
+    '''
+    def __init__(self, size=4096):
+        assert size & (size - 1) == 0 and size >= 512
+        self.size = size
+        self.ring = bytearray(size)
+        self.head = 0  # read counter, index is head & (size - 1)
+        self.tail = 0  # write counter
+        self.header = bytearray(10)
+        self.discarded = 0
+        self.header_errors = 0
+
+    def __len__(self):
+        return self.tail - self.head
+
+    def copy(self, dst, start, length):
+        # Copy length bytes at read counter start into dst, across the wrap
+        i = start & (self.size - 1)
+        first = min(length, self.size - i)
+        dst[0:first] = self.ring[i:i + first]
+        if first < length:
+            dst[first:length] = self.ring[0:length - first]
+
+    def write(self, data):
+        '''Append as much of data as fits and return the bytes taken'''
+        size = self.size
+        length = min(len(data), size - (self.tail - self.head))
+        i = self.tail & (size - 1)
+        first = min(length, size - i)
+        self.ring[i:i + first] = data[0:first]
+        if first < length:
+            self.ring[0:length - first] = data[first:length]
+        self.tail += length
+        if metrics is not None:
+            metrics.count('bytes_received', n=length)
+        return length
+
+    def buffer(self):
+        '''Return the free part of the ring to receive into, see commit()'''
+        size = self.size
+        i = self.tail & (size - 1)
+        room = min(size - (self.tail - self.head), size - i)
+        return memoryview(self.ring)[i:i + room]
+
+    def commit(self, length):
+        '''Account for length bytes received into buffer()'''
+        self.tail += length
+        if metrics is not None:
+            metrics.count('bytes_received', n=length)
+
+    def recv(self, sock):
+        '''Receive from sock into the ring, return bytes read (0 at EOF)'''
+        n = sock.recv_into(self.buffer())
+        self.commit(n)
+        return n
+
+    def feed(self, data):
+        '''Add a chunk of received bytes and yield complete frames'''
+        data = memoryview(data)
+        while True:
+            n = self.write(data)
+            data = data[n:]
+            for frame in self.frames():
+                yield frame
+            if not len(data):
+                break
+
+    def frames(self):
+        '''Yield complete frames in the ring'''
+        ring = self.ring
+        mask = self.size - 1
+        header = self.header
+        while True:
+            avail = self.tail - self.head
+            if avail < 2:
+                return
+
+            # Resync on link_start
+            i = self.head & mask
+            if ring[i] != 0x05 or ring[(i + 1) & mask] != 0x64:
+                end = min(i + avail, self.size)
+                found = ring.find(b'\x05', i + 1, end)
+                skip = (found if found >= 0 else end) - i
+                self.head += skip
+                self.discarded += skip
+                continue
+            if avail < 10:
+                return
+
+            # Check link header
+            self.copy(header, self.head, 10)
+            if (header[2] < 5 or
+                    crc16_dnp(header, 0, 8) != _U16.unpack_from(header, 8)[0]):
+                self.head += 1
+                self.discarded += 1
+                self.header_errors += 1
+                if metrics is not None:
+                    metrics.count('header_errors')
+                continue
+
+            length = frame_length(header[2])
+            if avail < length:
+                return
+            frame = bytearray(length)
+            self.copy(frame, self.head, length)
+            self.head += length
+            if metrics is not None:
+                metrics.count('frames_received')
+            yield frame
+
 class DnpDisasmBase(object):
-    '''Base class with convenience functions'''
+    '''Base class with convenience functions
+
+    Fields are read through an offset cursor (self.pos) over a memoryview
+    (self.view) and the underlying buffer is never modified. When
+    self.framed is set, self.pos counts user data bytes of a link frame
+    and the payload CRCs are skipped by index arithmetic.
+    '''
+    def __init__(self, view, framed=False, pos=0, end=0):
+        self.view = view
+        self.framed = framed
+        self.pos = pos
+        self.end = end
+
+    def offset(self, pos):
+        if self.framed:
+            return 10 + pos + (pos >> 4) * 2
+        return pos
+
+    def get_struct(self, s):
+        pos = self.pos
+        end = pos + s.size
+        if end > self.end:
+            raise IndexError('read past end of data')
+        self.pos = end
+        if self.framed and (pos & 15) + s.size > 16:
+            # Field straddles a payload CRC
+            view = self.view
+            return s.unpack(bytes(bytearray(
+                view[self.offset(p)] for p in range(pos, end))))
+        return s.unpack_from(self.view, self.offset(pos))
+
+    def read_into(self, dst, offset, length):
+        '''Copy length bytes at the cursor into dst at offset'''
+        pos = self.pos
+        end = pos + length
+        if end > self.end or length < 0:
+            raise IndexError('read past end of data')
+        self.pos = end
+        view = self.view
+        if not self.framed:
+            dst[offset:offset + length] = view[pos:end]
+            return
+        while pos < end:
+            n = min(16 - (pos & 15), end - pos)
+            p = self.offset(pos)
+            dst[offset:offset + n] = view[p:p + n]
+            offset += n
+            pos += n
+
+    def get_bytes(self, length):
+        '''Return the next length bytes, copied only if they cross a CRC'''
+        pos = self.pos
+        if not self.framed or (pos & 15) + length <= 16:
+            if pos + length > self.end or length < 0:
+                raise IndexError('read past end of data')
+            self.pos = pos + length
+            p = self.offset(pos)
+            return self.view[p:p + length]
+        data = bytearray(length)
+        self.read_into(data, 0, length)
+        return data
+
     def get_data1(self):
-        result = self.data[0]
-        del self.data[:1]
-        return result
+        pos = self.pos
+        if pos >= self.end:
+            raise IndexError('read past end of data')
+        self.pos = pos + 1
+        return self.view[self.offset(pos)]
 
     def get_data2(self):
-        result = self.data[0] + (self.data[1] << 8)
-        del self.data[:2]
-        return result
+        return self.get_struct(_U16)[0]
 
     def get_data4(self):
-        result = self.get_data2() + (self.get_data2() << 16)
-        return result
+        return self.get_struct(_U32)[0]
 
     def get_data6(self):
-        result = self.get_data4() + (self.get_data2() << 32)
-        return result
+        low, high = self.get_struct(_U48)
+        return low + (high << 32)
 
     def peek_data2(self):
-        result = self.data[0] + (self.data[1] << 8)
+        result = self.get_data2()
+        self.pos -= 2
         return result
 
 class DnpDataObject(object):
-    def __init__(self):
-	self.index = None
-	self.value = None
-	self.flag = None
+    '''One point of a DnpDisasmObject, a view on its columns'''
+    __slots__ = ('columns', 'i')
 
-class DnpDisasmObject(DnpDisasmBase):
-    '''Parse object part of DNP packet bytes'''
-    def __init__(self, data):
-        assert isinstance(data, bytearray)
-        self.data = data
+    def __init__(self, columns, i):
+        self.columns = columns
+        self.i = i
+
+    def item(self, column):
+        return None if column is None else column[self.i]
+
+    @property
+    def index(self):
+        return self.columns.index[self.i]
+
+    @property
+    def value(self):
+        return self.item(self.columns.value)
 
+    @property
+    def flag(self):
+        return self.item(self.columns.flag)
+
+    @property
+    def time(self):
+        return self.item(self.columns.time)
+
+class DnpDisasmObject(DnpDisasmBase):
+    '''Parse object part of DNP packet bytes
+
+    Reading starts at the cursor of parent and self.pos is left just past
+    the last byte of this object. Nothing is printed, see render().
+
+    Points are decoded into columns: self.index, self.value, self.flag
+    and self.time are arrays with one item per point, or None when the
+    object has no such field. self.objects makes DnpDataObject views of
+    the points on demand.
+    '''
+    def __init__(self, parent):
+        self.view = parent.view
+        self.framed = parent.framed
+        self.pos = parent.pos
+        self.end = parent.end
+        self.error = None
+        self.codec = None
+        self.group = self.variation = self.qualifier = None
+        self.prefix = self.ranges = None
+        self.start = self.stop = self.count = None
+        self.index = self.value = self.flag = self.time = None
+        self._objects = None
+        try:
+            self.decode(parent)
+        except IndexError:
+            # Object cut short, though the CRCs are good
+            self.start = self.stop = self.count = None
+            self.index = self.value = self.flag = self.time = None
+            self.error = 'ERROR: Truncated object: group={} variation={}'.format(
+                self.group, self.variation)
+            self.pos = self.end
+
+    def decode(self, parent):
         # Get object header
         self.group = self.get_data1()
         self.variation = self.get_data1()
         self.qualifier = self.get_data1()
         self.prefix = (self.qualifier >> 4) & 0x7
         self.ranges = (self.qualifier >> 0) & 0xf
-        self.objects = []
 
         # Process range
         start = -1
@@ -313,99 +1315,117 @@ class DnpDisasmObject(DnpDisasmBase):
         elif self.ranges == 6:
             pass
         else:
-            print 'ERROR: Not implemented: group={} variation={} prefix={} ranges={}'.format(
+            self.start = self.stop = self.count = None
+            self.error = 'ERROR: Not implemented: group={} variation={} prefix={} ranges={}'.format(
                 self.group, self.variation, self.prefix, self.ranges)
+            self.pos = self.end
+            return
+        if end < start:
+            self.start = self.stop = self.count = None
+            self.error = 'ERROR: Invalid range: group={} variation={} start={} stop={}'.format(
+                self.group, self.variation, start, end)
+            self.pos = self.end
             return
         if count < 0:
             count = end + 1 - start
-
-        # Print object header
-        rangestr = '<UNKNOWN RANGE>'
-        if start >= 0:
-            rangestr = '{}-{}'.format(start, end)
-        elif count >= 0:
-            rangestr = 'count={}'.format(count)
-        print '    object (group={} variation={} prefix={} ranges={}({}))'.format(
-            self.group, self.variation, self.prefix, self.ranges, rangestr)
-
-        # Debug dump before objects
-        # print '>>>', dump_bytes(self.data)
+        self.start = start
+        self.stop = end
+        self.count = count
 
         # Read objects under this object header
         if self.ranges == 6: # No range field, implies all values
             pass
         elif self.ranges != 11:
-            for i in range(count):
-                # Create a data object
-                do = DnpDataObject()
-                self.objects.append(do)
-
-                # Decide index
-                if self.prefix == 0:
-                    do.index = i + start
-                elif self.prefix == 1:
-                    do.index = self.get_data1()
-                elif self.prefix == 2:
-                    do.index = self.get_data2()
-                elif self.prefix == 3:
-                    do.index = self.get_data4()
-
-                # Switch by group and variation
-                gv = (self.group, self.variation)
-                if gv == (1, 1):  # 8bit binary packed
-                    do.value = self.get_data1()
-                    assert count == 1  # Then only bit 0 is valid
-                    print '      BI index {}: {}'.format(do.index, do.value & 0x1)
-                elif gv == (1, 0):  # Index only
-                    print '      index {}'.format(do.index)
-                elif gv == (1, 2):  # 8bit binary
-                    do.flag = self.get_data1()
-                    do.value = (do.flag >> 7) & 0x1
-                    do.flag &= 0x3f
-                    print '      BI index {}: {} (flag=0x{:x})'.format(do.index, do.value, do.flag)
-                elif gv == (2, 3):  # 8bit flag and 16bit relative time
-                    do.flag = self.get_data1()
-                    time = self.get_data2()
-                    print '      BI index {}: 0x{:x}'.format(do.index, do.flag)
-                elif gv == (30, 0):  # Index only
-                    print '      index {}'.format(do.index)
-                elif gv == (30, 1):  # 32bit with flag
-                    do.flag = self.get_data1()
-                    do.value = self.get_data4()
-                    print '      AI index {}: {} (flag=0x{:x})'.format(do.index, do.value, do.flag)
-                elif gv == (30, 3):  # 32bit value
-                    do.value = self.get_data4()
-                    print '      AI index {}: {}'.format(do.index, do.value)
-                elif gv == (34, 2):  # 32bit value
-                    do.value = self.get_data4()
-                    print '      deadband index {}: {}'.format(do.index, do.value)
-                elif gv == (40, 0):  # Index only
-                    print '      index {}'.format(do.index)
-                elif gv == (40, 1):  # 32bit with flag
-                    do.flag = self.get_data1()
-                    do.value = self.get_data4()
-                    print '      AO index {}: {} (flag=0x{:x})'.format(do.index, do.value, do.flag)
-                elif gv == (40, 2):  # 16bit with flag
-                    do.flag = self.get_data1()
-                    do.value = self.get_data2()
-                    print '      AO index {}: {} (flag=0x{:x})'.format(do.index, do.value, do.flag)
-                elif gv == (41, 1):  # 32bit value and control flag
-                    do.value = self.get_data4()
-                    do.flag = self.get_data1()
-                    print '      AO index {}: {} (flag=0x{:x})'.format(do.index, do.value, do.flag)
-                elif gv == (42, 2):  # 16bit value and control flag
-                    do.flag = self.get_data1()
-                    do.value = self.get_data2()
-                    print '      AO index {}: {} (flag=0x{:x})'.format(do.index, do.value, do.flag)
-                else:
-                    print 'ERROR: Not implemented: group={} variation={} prefix={}'.format(
-                        self.group, self.variation, self.prefix)
-                    return
+            if getattr(parent, 'application_function', None) == Function.READ:
+                self.codec = codec = _INDEX_ONLY
+            else:
+                self.codec = codec = CODECS.get((self.group, self.variation))
+            if codec is None or self.prefix not in _PREFIX_FORMATS:
+                self.error = 'ERROR: Not implemented: group={} variation={} prefix={}'.format(
+                    self.group, self.variation, self.prefix)
+                self.pos = self.end
+                return
+            if codec.packed:
+                self.decode_packed(count, start)
+            else:
+                self.decode_records(codec, count, start)
+                if codec.relative and self.time is not None:
+                    self.absolute_time(getattr(parent, 'cto', None))
+                elif self.group == 51 and self.time:
+                    parent.cto = self.time[-1]  # for relative times that follow
         else:
-            print 'ERROR: Not Implemented: prefix={} ranges={} start={} end={} count={}'.format(
+            self.error = 'ERROR: Not Implemented: prefix={} ranges={} start={} end={} count={}'.format(
                 self.prefix, self.ranges, start, end, count)
+            self.pos = self.end
+
+    def decode_records(self, codec, count, start):
+        # Split the whole block of count records into one column per field
+        size, fields = codec.record_layout(self.prefix)
+        if not self.prefix:
+            start = max(start, 0)  # count only, no start
+            self.index = array('I', range(start, start + count))
+        if size:
+            records = self.get_bytes(size * count)
+            for name, code, offset, length in fields:
+                setattr(self, name, split_column(records, code, offset, length, size, count))
+        if codec.state_in_flag:
+            flag = self.flag.tobytes()
+            self.value = array('B', flag.translate(_FLAG_STATE))
+            self.flag = array('B', flag.translate(_FLAG_BITS))
+
+    def absolute_time(self, cto):
+        # Add the common time of occurrence to relative times; without
+        # one they are left relative
+        if cto is None:
+            return
+        self.time = array('q', [cto + t for t in self.time])
+
+    def decode_packed(self, count, start):
+        # One bit per point, no prefix
+        start = max(start, 0)  # count only, no start
+        data = self.get_bytes((count + 7) // 8)
+        self.index = array('I', range(start, start + count))
+        self.value = unpack_bits(data, count)
+
+    @property
+    def objects(self):
+        if self._objects is None:
+            count = 0 if self.index is None else len(self.index)
+            self._objects = [DnpDataObject(self, i) for i in range(count)]
+        return self._objects
+
+    def render(self):
+        '''Return pretty-print lines of this object'''
+        if self.count is None:
+            return [self.error]
+
+        rangestr = '<UNKNOWN RANGE>'
+        if self.start >= 0:
+            rangestr = '{}-{}'.format(self.start, self.stop)
+        elif self.count >= 0:
+            rangestr = 'count={}'.format(self.count)
+        lines = ['    object (group={} variation={} prefix={} ranges={}({}))'.format(
+            self.group, self.variation, self.prefix, self.ranges, rangestr)]
+
+        if self.objects:
+            fmt = self.codec.point_format
+            for do in self.objects:
+                lines.append(fmt.format(do))
+        if self.error:
+            lines.append(self.error)
+        return lines
 
 class Function:
+    CONFIRM = 0x0
+    READ = 0x1
+    WRITE = 0x2
+    DIRECT_OPERATE = 0x5
+    ENABLE_UNSOLICITED = 0x14
+    DISABLE_UNSOLICITED = 0x15
+    RECORD_CURRENT_TIME = 0x18
+    RESPONSE = 0x81
+    UNSOLICITED_RESPONSE = 0x82
+
     def __init__(self, data):
         self.code = data
 
@@ -415,9 +1435,26 @@ class Function:
         if self.code == 0x1: result = 'READ'
         if self.code == 0x2: result = 'WRITE'
         if self.code == 0x5: result = 'DIRECT_OPERATE'
+        if self.code == 0x14: result = 'ENABLE_UNSOLICITED'
+        if self.code == 0x15: result = 'DISABLE_UNSOLICITED'
+        if self.code == 0x18: result = 'RECORD_CURRENT_TIME'
         if self.code == 0x81: result = 'RESPONSE'
+        if self.code == 0x82: result = 'UNSOLICITED_RESPONSE'
         return '{:s}({:d})'.format(result, self.code)
 
+class LinkFunction:
+    # Primary frames (PRM set)
+    RESET_LINK_STATES = 0x0
+    TEST_LINK = 0x2
+    CONFIRMED_USER_DATA = 0x3
+    UNCONFIRMED_USER_DATA = 0x4
+    REQUEST_LINK_STATUS = 0x9
+    # Secondary frames
+    ACK = 0x0
+    NACK = 0x1
+    LINK_STATUS = 0xb
+    NOT_SUPPORTED = 0xf
+
 class Control:
     def __init__(self, data):
         self.code = data
@@ -435,6 +1472,21 @@ class Control:
         return '0x{:02x}({:s})'.format(self.code, ','.join(self.strings))
 
 class IIN:
+    ALL_STATIONS = 1 << 0
+    CLASS1 = 1 << 1
+    CLASS2 = 1 << 2
+    CLASS3 = 1 << 3
+    NEED_TIME = 1 << 4
+    LOCAL_CONTROL = 1 << 5
+    DEVICE_TROUBLE = 1 << 6
+    DEVICE_RESTART = 1 << 7
+    NO_FUNC_CODE_SUPPORT = 1 << 8
+    OBJECT_UNKNOWN = 1 << 9
+    PARAMETER_ERROR = 1 << 10
+    EVENT_BUFFER_OVERFLOW = 1 << 11
+    ALREADY_EXECUTING = 1 << 12
+    CONFIG_CORRUPT = 1 << 13
+
     def __init__(self, data):
         self.code = data
 
@@ -456,60 +1508,354 @@ class IIN:
         if self.code & (1 << 13): result.append('CONFIG_CORRUPT')
         return '0x{:x}({:s})'.format(self.code, ','.join(result))
 
-class DnpDisasm(DnpDisasmBase):
-    '''Parse DNP packet bytes'''
-    def __init__(self, data, request=False):
-        assert isinstance(data, bytearray)
-        self.data = bytearray(data)  # Make a copy
+# (bit, name) of each IIN flag
+_IIN_NAMES = sorted((value, name) for name, value in vars(IIN).items() if name.isupper())
 
-        if request:
-            print '>', dump_bytes(self.data)
+class DnpDisasm(DnpDisasmBase):
+    '''Parse DNP packet bytes
+
+    data may be any buffer (bytes, bytearray, memoryview) holding a link
+    frame at offset. It is parsed in place, without copying or modifying.
+    With fragment set, data is instead a whole application fragment with
+    no link or transport header, as returned by DnpReassembler.
+
+    Headers are decoded at once and object headers on first access of
+    self.objects. Unless quiet, the packet is pretty-printed as before;
+    quiet defaults to the class attribute DnpDisasm.quiet.
+
+    When strict (default DnpDisasm.strict), the header and every payload
+    CRC are verified before anything is decoded. A bad frame raises
+    DnpCrcError and is counted in DnpDisasm.crc_errors.
+    '''
+    quiet = False
+    strict = False
+    crc_errors = 0
+
+    def __init__(self, data, request=False, offset=0, quiet=None, strict=None,
+                 fragment=False):
+        m = metrics
+        if m is not None:
+            started = time.perf_counter()
+        self.data = data
+        self.view = memoryview(data)[offset:]
+        self.framed = not fragment
+        self.request = request
+
+        if fragment:
+            self.link_start = self.link_length = self.link_control = None
+            self.link_destination = self.link_source = self.link_crc = None
+            self.transport_header = None
+            self.pos = 0
+            self.end = len(self.view)
         else:
-            print '<', dump_bytes(self.data)
-
-        # Get link header
-        self.link_start = self.get_data2()
-        self.link_length = self.get_data1()
-        self.link_control = self.get_data1()
-        self.link_destination = self.get_data2()
-        self.link_source = self.get_data2()
-        self.link_crc = self.get_data2()
-        # print '    link (control=0x{:x}, dst=0x{:x}, src=0x{:x})'.format(
-        #     self.link_control, self.link_destination, self.link_source)
-        assert self.link_start == 0x6405
-
-        # Remove payload CRC, for each 16 byte payload and at the end
-        p = 0
-        while p < len(self.data):
-            if len(self.data) - p >= 18:
-                p += 16
-            else:
-                p = len(self.data) - 2
-            del self.data[p:p+2]
-
-        # Get transport header
-        self.transport_header = self.get_data1()
-        # print '    transport (header=0x{:x})'.format(self.transport_header)
-
-        # Debug dump for application after without CRC
-        # print '>>>', dump_bytes(self.data)
+            if strict is None:
+                strict = DnpDisasm.strict
+            if strict and not verify_frame(self.view):
+                DnpDisasm.crc_errors += 1
+                if m is not None:
+                    m.count('crc_errors')
+                raise DnpCrcError('bad CRC in frame: ' + dump_bytes(self.view[:10]))
+
+            # Get link header
+            (self.link_start, self.link_length, self.link_control,
+             self.link_destination, self.link_source,
+             self.link_crc) = _LINK_HEADER.unpack_from(self.view, 0)
+            assert self.link_start == 0x6405
+
+            # Payload CRCs are skipped by the cursor, see DnpDisasmBase
+            self.pos = 0
+            self.end = self.link_length - 5
+
+            # Get transport header
+            self.transport_header = self.get_data1()
 
         # Get application header
         self.application_control = self.get_data1()
         self.application_function = self.get_data1()
-        control = Control(self.application_control)
-        function = Function(self.application_function)
-        print '    application (control={:s} function={:s})'.format(control, function)
-
-        self.application_con = control.con
-        self.application_uns = control.uns
+        self.application_seq = self.application_control & 0x0f
+        self.application_fir = bool(self.application_control & (1 << 7))
+        self.application_fin = bool(self.application_control & (1 << 6))
+        self.application_con = bool(self.application_control & (1 << 5))
+        self.application_uns = bool(self.application_control & (1 << 4))
 
+        self.iin = None
         if self.application_function & 0x80:
             self.iin = self.get_data2()
-            iin = IIN(self.iin)
-            print '    iin={:s}'.format(iin)
 
-        # Get objects
-        self.objects = []
-        while self.data:
-            self.objects.append(DnpDisasmObject(self.data))
+        # Objects are decoded lazily from here
+        self.objects_pos = self.pos
+        self._objects = None
+
+        if m is not None:
+            m.time('parse', time.perf_counter() - started)
+            m.count('fragments_parsed' if fragment else 'frames_parsed')
+            if self.iin:
+                m.count_iin(self.iin)
+
+        if quiet is None:
+            quiet = DnpDisasm.quiet
+        if not quiet:
+            self.dump()
+
+    def extend(self, res):
+        '''Add the objects and IIN of res, a later fragment of this response'''
+        self._objects = self.objects + res.objects
+        if res.iin is not None:
+            self.iin = (self.iin or 0) | res.iin
+
+    def objects_key(self):
+        '''Return the decode cache key of the objects: their bytes, CRCs stripped'''
+        length = self.end - self.objects_pos
+        if not self.framed:
+            data = self.view[self.objects_pos:self.end].tobytes()
+        else:
+            data = bytearray(length)
+            self.pos = self.objects_pos
+            self.read_into(data, 0, length)
+            data = bytes(data)
+        # Objects of READ requests carry indices only, see DnpDisasmObject
+        return (self.application_function == Function.READ, data)
+
+    @property
+    def objects(self):
+        if self._objects is None:
+            cache = decode_cache
+            if cache is not None:
+                key = self.objects_key()
+                objects = cache.get(key)
+                if metrics is not None:
+                    metrics.count('decode_cache_misses' if objects is None else 'decode_cache_hits')
+                if objects is not None:
+                    self._objects = objects
+                    self.pos = self.end
+                    return objects
+            self._objects = []
+            self.cto = None  # common time of occurrence
+            self.pos = self.objects_pos
+            m = metrics
+            while self.pos < self.end:
+                if m is not None:
+                    started = time.perf_counter()
+                obj = DnpDisasmObject(self)
+                if m is not None:
+                    m.time('decode', time.perf_counter() - started,
+                           ('object', '{}/{}'.format(obj.group, obj.variation)))
+                self._objects.append(obj)
+                self.pos = obj.pos
+            if cache is not None:
+                for obj in self._objects:
+                    obj.view = None  # decoded, do not keep the packet
+                cache.put(key, self._objects)
+        return self._objects
+
+    def render(self):
+        '''Return the hex dump and pretty-print of this packet'''
+        lines = []
+        if self.framed:
+            frame = dump_bytes(self.view[:frame_length(self.link_length)])
+        else:
+            frame = dump_bytes(self.view)
+        if self.request:
+            lines.append('> ' + frame)
+        else:
+            lines.append('< ' + frame)
+        # lines.append('    link (control=0x{:x}, dst=0x{:x}, src=0x{:x})'.format(
+        #     self.link_control, self.link_destination, self.link_source))
+        # lines.append('    transport (header=0x{:x})'.format(self.transport_header))
+        lines.append('    application (control={} function={})'.format(
+            Control(self.application_control), Function(self.application_function)))
+        if self.iin is not None:
+            lines.append('    iin={}'.format(IIN(self.iin)))
+        for obj in self.objects:
+            lines.extend(obj.render())
+        return '\n'.join(lines)
+
+    def dump(self):
+        '''Print the hex dump and pretty-print of this packet'''
+        print(self.render())
+
+class DnpReassembler(object):
+    '''Reassemble transport segments into application fragments
+
+    feed() takes one link frame at a time and returns a DnpDisasm of each
+    completed fragment, or None while segments are outstanding. A frame
+    holding a whole fragment (FIR and FIN) is parsed in place. Otherwise
+    segments are kept per (source, destination) in preallocated slots
+    indexed by transport sequence number, so segments after the FIR one
+    may arrive out of order and duplicates are dropped. A FIR segment
+    discards what is left of an earlier, incomplete fragment. A fragment
+    may span at most 64 segments: one growing longer, or with a segment
+    other than a duplicate in a slot already filled, is dropped and
+    counted in self.dropped, along with its later segments.
+    quiet and strict are passed on to DnpDisasm.
+    '''
+    def __init__(self, quiet=None, strict=None):
+        self.quiet = quiet
+        self.strict = strict
+        self.associations = {}
+        self.scratch = bytearray(SEGMENT_SIZE)
+        self.duplicates = 0
+        self.dropped = 0
+
+    def feed(self, frame):
+        view = memoryview(frame)
+        strict = self.strict
+        if strict is None:
+            strict = DnpDisasm.strict
+        if strict and not verify_frame(view):
+            DnpDisasm.crc_errors += 1
+            if metrics is not None:
+                metrics.count('crc_errors')
+            raise DnpCrcError('bad CRC in frame: ' + dump_bytes(view[:10]))
+        (start, link_length, control, dst, src,
+         crc) = _LINK_HEADER.unpack_from(view, 0)
+        transport = view[10]
+        seq = transport & 0x3f
+        fir = transport & 0x40
+        fin = transport & 0x80
+
+        assoc = self.associations.get((src, dst))
+        if fir and fin:
+            if assoc is not None:
+                assoc.reset()
+            return DnpDisasm(frame, quiet=self.quiet, strict=False)
+        if assoc is None:
+            assoc = self.associations[(src, dst)] = _DnpAssociation()
+
+        # Copy segment into its slot, unless it is a duplicate
+        length = link_length - 6
+        reader = DnpDisasmBase(view, True, 1, link_length - 5)
+        reader.read_into(self.scratch, 0, length)
+        slot = memoryview(assoc.slots)[seq * SEGMENT_SIZE:seq * SEGMENT_SIZE + length]
+        if assoc.lengths[seq] == length and slot == memoryview(self.scratch)[:length]:
+            self.duplicates += 1
+            if metrics is not None:
+                metrics.count('duplicate_segments')
+            return None
+        if fir:
+            assoc.reset()  # drop the segments of an unfinished fragment
+        elif assoc.fir is None:  # no fragment started, or it was dropped
+            return None
+        elif assoc.lengths[seq] >= 0 or assoc.count == MAX_SEGMENTS:
+            # Sequence numbers wrapped: more than 64 segments
+            assoc.reset()
+            self.dropped += 1
+            if metrics is not None:
+                metrics.count('dropped_fragments')
+            return None
+        slot[:] = self.scratch[:length]
+        assoc.lengths[seq] = length
+        assoc.count += 1
+        if fir:
+            assoc.fir = seq
+        if fin:
+            assoc.fin = seq
+
+        fragment = assoc.collect()
+        if fragment is None:
+            return None
+        res = DnpDisasm(fragment, quiet=self.quiet, fragment=True)
+        res.link_control = control
+        res.link_destination = dst
+        res.link_source = src
+        return res
+
+class _DnpAssociation(object):
+    '''Segment slots of one (source, destination) pair'''
+    def __init__(self):
+        self.slots = bytearray(MAX_SEGMENTS * SEGMENT_SIZE)
+        self.lengths = [-1] * MAX_SEGMENTS
+        self.fir = None
+        self.fin = None
+        self.count = 0  # segments since FIR
+
+    def reset(self):
+        self.lengths[:] = [-1] * MAX_SEGMENTS
+        self.fir = None
+        self.fin = None
+        self.count = 0
+
+    def collect(self):
+        # Return the fragment once every segment from FIR to FIN is in
+        if self.fir is None or self.fin is None:
+            return None
+        seqs = [(self.fir + i) & 0x3f for i in range(((self.fin - self.fir) & 0x3f) + 1)]
+        lengths = self.lengths
+        if any(lengths[seq] < 0 for seq in seqs):
+            return None
+        slots = memoryview(self.slots)
+        fragment = b''.join(
+            slots[seq * SEGMENT_SIZE:seq * SEGMENT_SIZE + lengths[seq]] for seq in seqs)
+        self.reset()
+        return fragment
+
+class DnpLink(object):
+    '''Link layer state of a station towards one peer
+
+    Sending confirmed user data: reset() returns the RESET_LINK_STATES
+    frame to send first, and confirmed(frame) a user data frame as
+    CONFIRMED_USER_DATA with the current FCB. The caller sends each one
+    until it is acknowledged (retransmitting it unchanged on timeout),
+    then calls acked() before the next.
+
+    receive(frame) handles every received frame and returns (deliver,
+    reply, ack): whether the frame holds user data for the transport
+    layer, the frame to answer with or None, and the function of a
+    secondary frame (ACK, NACK...) or None. Confirmed user data is
+    acknowledged and a repeated frame (same FCB) is not delivered again.
+    '''
+    def __init__(self, local=0, remote=0, master=True):
+        self.local = local
+        self.remote = remote
+        self.dir = 1 if master else 0
+        self.ready = False  # link states reset, see reset()
+        self.fcb = 1  # FCB of the next confirmed frame sent
+        self.expected = None  # FCB of the next confirmed frame received
+
+    def reset(self):
+        self.fcb = 1
+        return DnpAsm.link_frame(self.local, self.remote, LinkFunction.RESET_LINK_STATES,
+                                 self.dir)
+
+    def confirmed(self, frame):
+        frame = bytearray(frame)
+        set_link_control(frame, (self.dir << 7) | (1 << 6) | (self.fcb << 5) | (1 << 4) |
+                         LinkFunction.CONFIRMED_USER_DATA)
+        return frame
+
+    def acked(self):
+        self.fcb ^= 1
+
+    def receive(self, frame):
+        control = frame[3]
+        function = control & 0x0f
+        if not control & (1 << 6):  # secondary
+            return False, None, function
+        if function == LinkFunction.UNCONFIRMED_USER_DATA:
+            return True, None, None
+
+        # Answer from the destination of the frame to its source
+        dst = frame[4] | (frame[5] << 8)
+        src = frame[6] | (frame[7] << 8)
+        if function == LinkFunction.CONFIRMED_USER_DATA:
+            if not verify_frame(frame):  # not acknowledged, to be repeated
+                return False, None, None
+            if self.expected is None:  # peer has not reset the link
+                return False, self.reply(dst, src, LinkFunction.NACK), None
+            fcb = (control >> 5) & 0x1
+            ack = self.reply(dst, src, LinkFunction.ACK)
+            if fcb != self.expected:  # repeated, our ACK was lost
+                return False, ack, None
+            self.expected ^= 1
+            return True, ack, None
+        if function == LinkFunction.RESET_LINK_STATES:
+            self.expected = 1
+            return False, self.reply(dst, src, LinkFunction.ACK), None
+        if function == LinkFunction.TEST_LINK:
+            return False, self.reply(dst, src, LinkFunction.ACK), None
+        if function == LinkFunction.REQUEST_LINK_STATUS:
+            return False, self.reply(dst, src, LinkFunction.LINK_STATUS), None
+        return False, self.reply(dst, src, LinkFunction.NOT_SUPPORTED), None
+
+    def reply(self, src, dst, function):
+        return DnpAsm.link_frame(src, dst, function, self.dir, 0)
@@ -0,0 +1,397 @@
+#!/usr/bin/python
+
+# asyncio DNP master
+#     - DnpAsyncMaster: polls many outstations concurrently, one TCP
+#       connection per outstation
+#     - DnpPointDelta: the points of a response that changed since the
+#       last one
+
+import DnpSimple
+import asyncio
+import itertools
+import sys
+import time
+
+# Event object groups; their points are all reported as changes
+_EVENT_GROUPS = frozenset((2, 4, 11, 13, 22, 23, 32, 33, 42, 43))
+
+class DnpPointDelta(object):
+    '''Points that changed since the previous responses, per outstation
+
+    changes(addr, res) returns (group, index, value, flag) of each point
+    of res that is new or differs from when outstation addr last
+    reported it. An object with the same columns as the last object of
+    the same header costs no work per point, which is the usual case of
+    a repeated poll (and, with DnpSimple.enable_decode_cache(), the
+    columns are then the very same arrays). Events are all reported.
+    '''
+    def __init__(self):
+        self.points = {}  # (addr, group) -> {index: (value, flag)}
+        self.objects = {}  # (addr, group, variation, start) -> columns
+
+    def reset(self, addr=None):
+        # Forget the points of outstation addr, or of all
+        if addr is None:
+            self.points.clear()
+            self.objects.clear()
+            return
+        for table in (self.points, self.objects):
+            for key in [key for key in table if key[0] == addr]:
+                del table[key]
+
+    def changes(self, addr, res):
+        changed = []
+        for obj in res.objects:
+            if obj.index is None or (obj.value is None and obj.flag is None):
+                continue
+            group = obj.group
+            values = itertools.repeat(None) if obj.value is None else obj.value
+            flags = itertools.repeat(None) if obj.flag is None else obj.flag
+            if group in _EVENT_GROUPS:
+                changed.extend((group, index, value, flag)
+                               for index, value, flag in zip(obj.index, values, flags))
+                continue
+            key = (addr, group, obj.variation, obj.start)
+            columns = (obj.index, obj.value, obj.flag)
+            if self.objects.get(key) == columns:
+                continue
+            self.objects[key] = columns
+            points = self.points.setdefault((addr, group), {})
+            for index, value, flag in zip(obj.index, values, flags):
+                point = (value, flag)
+                if points.get(index) != point:
+                    points[index] = point
+                    changed.append((group, index, value, flag))
+        return changed
+
+class DnpMasterProtocol(asyncio.BufferedProtocol):
+    '''Connection to one outstation
+
+    Bytes are received straight into the ring of a DnpFramer. Responses
+    are matched to requests by application sequence number; unsolicited
+    responses are passed to the master. Responses asking for a
+    confirmation (CON) are confirmed at once. A response with NEED_TIME
+    starts a time synchronization, unless the master has auto_time off.
+
+    A response in several fragments is collected into the DnpDisasm of
+    its first one. Up to window requests are outstanding at a time, each
+    with its own sequence number. With confirmed, requests are sent as confirmed
+    link user data: every frame is repeated until acknowledged.
+    '''
+    def __init__(self, master, addr, window=1, confirmed=False):
+        self.master = master
+        self.addr = addr
+        self.framer = DnpSimple.DnpFramer()
+        self.reassembler = DnpSimple.DnpReassembler(quiet=True, strict=True)
+        self.link = DnpSimple.DnpLink(master.address, addr)
+        self.confirmed = confirmed
+        self.transport = None
+        self.seq = 0
+        self.pending = {}  # application seq -> future
+        self.window = asyncio.Semaphore(min(window, 15))
+        self.link_lock = asyncio.Lock()
+        self.link_ack = None
+        self.partial = None  # first fragments of a response, see response_received()
+        self.time_sync = None  # task setting the outstation clock
+        self.closed = asyncio.get_event_loop().create_future()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        if self.time_sync is not None:
+            self.time_sync.cancel()
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(exc or EOFError('DNP outstation disconnected'))
+        self.pending.clear()
+        if not self.closed.done():
+            self.closed.set_result(exc)
+
+    def get_buffer(self, sizehint):
+        return self.framer.buffer()
+
+    def buffer_updated(self, nbytes):
+        self.framer.commit(nbytes)
+        for frame in self.framer.frames():
+            self.frame_received(frame)
+
+    def frame_received(self, frame):
+        deliver, reply, ack = self.link.receive(frame)
+        if reply is not None:
+            self.write(reply)
+        if ack is not None:
+            if self.link_ack is not None and not self.link_ack.done():
+                self.link_ack.set_result(ack)
+            return
+        if not deliver:
+            return
+        try:
+            res = self.reassembler.feed(frame)
+        except (DnpSimple.DnpCrcError, IndexError, ValueError):
+            return
+        if res is not None:
+            self.response_received(res)
+
+    def write(self, data):
+        self.transport.write(data)
+        if DnpSimple.metrics is not None:
+            DnpSimple.metrics.sent(data)
+
+    def response_received(self, res):
+        if res.application_con:
+            self.write(DnpSimple.DnpAsm.request_confirm(
+                self.master.address, self.addr, 0, seq=res.application_seq,
+                uns=int(res.application_uns)))
+        if res.iin & DnpSimple.IIN.NEED_TIME and self.master.auto_time and self.time_sync is None:
+            self.time_sync = asyncio.ensure_future(self.master.sync_time(self.addr))
+            self.time_sync.add_done_callback(self.time_synced)
+        if res.application_uns:
+            self.master.unsolicited_received(self.addr, res)
+            return
+        if not (res.application_fir and res.application_fin):
+            # Later fragments take the next sequence numbers
+            if res.application_fir:
+                self.partial = res
+            elif self.partial is not None:
+                self.partial.extend(res)
+            if not res.application_fin or self.partial is None:
+                return
+            res, self.partial = self.partial, None
+        future = self.pending.pop(res.application_seq, None)
+        if future is not None and not future.done():
+            future.set_result(res)
+
+    def time_synced(self, task):
+        self.time_sync = None
+        if not task.cancelled() and task.exception() is not None:
+            self.master.poll_errors += 1
+
+    async def send(self, data):
+        '''Write frames, as confirmed user data if self.confirmed'''
+        if not self.confirmed:
+            self.write(data)
+            return
+        async with self.link_lock:
+            link = self.link
+            if not link.ready:
+                await self.exchange(link.reset())
+                link.ready = True
+            p = 0
+            while p < len(data):
+                n = DnpSimple.frame_length(data[p + 2])
+                await self.exchange(link.confirmed(data[p:p + n]))
+                link.acked()
+                p += n
+
+    async def exchange(self, frame):
+        # Send a frame until the outstation acknowledges it
+        master = self.master
+        for retry in range(master.link_retries + 1):
+            self.link_ack = asyncio.get_event_loop().create_future()
+            self.write(frame)
+            try:
+                ack = await asyncio.wait_for(self.link_ack, master.link_timeout)
+            except asyncio.TimeoutError:
+                if DnpSimple.metrics is not None:
+                    DnpSimple.metrics.count('link_retries')
+                continue
+            finally:
+                self.link_ack = None
+            if ack == DnpSimple.LinkFunction.ACK:
+                return
+            self.link.ready = False  # reset the link before the next frame
+            raise DnpSimple.DnpError('link frame not acknowledged: function {}'.format(ack))
+        self.link.ready = False
+        raise asyncio.TimeoutError('no link ACK from outstation {}'.format(self.addr))
+
+    async def request(self, build, timeout):
+        '''Send build(seq) and return the DnpDisasm of its response'''
+        async with self.window:
+            seq = self.seq
+            while seq in self.pending:
+                seq = (seq + 1) & 0x0f
+            self.seq = (seq + 1) & 0x0f
+            future = asyncio.get_event_loop().create_future()
+            self.pending[seq] = future
+            started = time.perf_counter()
+            try:
+                await self.send(build(seq))
+                res = await asyncio.wait_for(future, timeout)
+            finally:
+                self.pending.pop(seq, None)
+            m = DnpSimple.metrics
+            if m is not None:
+                m.observe('latency', time.perf_counter() - started, ('outstation', self.addr))
+            return res
+
+class DnpAsyncMaster(object):
+    '''DNP master polling many outstations concurrently
+
+    Outstations are keyed by link address. Each request method sends one
+    request, waits at most timeout seconds for the response and returns
+    the decoded value (or the DnpDisasm of the response).
+
+        master = DnpAsyncMaster()
+        await master.add_outstation(123, 'localhost', 20000)
+        value = await master.read_analog_in(123, 0)
+
+    on_unsolicited, if given, is called as on_unsolicited(addr, res)
+    with the DnpDisasm of each unsolicited response.
+
+    window is the default number of requests kept outstanding on each
+    connection (1 unless the outstation is known to take pipelined
+    requests), and confirmed selects confirmed link service, where a
+    frame is repeated every link_timeout seconds, link_retries times at
+    most, until acknowledged.
+
+    With auto_time, an outstation flagging NEED_TIME in a response gets
+    its clock set by sync_time().
+    '''
+    def __init__(self, address=0, timeout=5.0, on_unsolicited=None, window=1,
+                 confirmed=False, link_timeout=1.0, link_retries=2, auto_time=True):
+        self.address = address
+        self.timeout = timeout
+        self.on_unsolicited = on_unsolicited
+        self.window = window
+        self.confirmed = confirmed
+        self.link_timeout = link_timeout
+        self.link_retries = link_retries
+        self.auto_time = auto_time
+        self.delta = DnpPointDelta()
+        self.outstations = {}
+        self.polls = []
+        self.poll_errors = 0
+
+    async def add_outstation(self, addr, host, port=20000, window=None, confirmed=None):
+        if window is None:
+            window = self.window
+        if confirmed is None:
+            confirmed = self.confirmed
+        loop = asyncio.get_event_loop()
+        transport, protocol = await loop.create_connection(
+            lambda: DnpMasterProtocol(self, addr, window, confirmed), host, port)
+        self.outstations[addr] = protocol
+        return protocol
+
+    async def close(self):
+        for task in self.polls:
+            task.cancel()
+        for protocol in self.outstations.values():
+            protocol.transport.close()
+            await protocol.closed
+        self.outstations.clear()
+
+    async def request(self, addr, build, timeout=None):
+        '''Send build(seq) to outstation addr and return the response'''
+        if timeout is None:
+            timeout = self.timeout
+        return await self.outstations[addr].request(build, timeout)
+
+    def unsolicited_received(self, addr, res):
+        if self.on_unsolicited is not None:
+            self.on_unsolicited(addr, res)
+
+    @staticmethod
+    def first_value(res):
+        # Value of the first point in a response, None if there is none
+        for obj in res.objects:
+            if obj.value:
+                return obj.value[0]
+        return None
+
+    async def read_analog_in(self, addr, index, timeout=None):
+        res = await self.request(addr, lambda seq: DnpSimple.DnpAsm.request_analog_in(
+            self.address, addr, index, seq=seq), timeout)
+        return self.first_value(res)
+
+    async def read_binary_in(self, addr, index, timeout=None):
+        res = await self.request(addr, lambda seq: DnpSimple.DnpAsm.request_binary_in(
+            self.address, addr, index, seq=seq), timeout)
+        return self.first_value(res)
+
+    async def read_analog_out_status(self, addr, index, timeout=None):
+        res = await self.request(addr, lambda seq: DnpSimple.DnpAsm.request_analog_out_status(
+            self.address, addr, index, seq=seq), timeout)
+        return self.first_value(res)
+
+    async def write_analog_out(self, addr, index, value, timeout=None):
+        res = await self.request(addr, lambda seq: DnpSimple.DnpAsm.request_analog_out(
+            self.address, addr, index, value, seq=seq), timeout)
+        return self.first_value(res)
+
+    async def write_deadband(self, addr, index, value, timeout=None):
+        return await self.request(addr, lambda seq: DnpSimple.DnpAsm.request_deadband(
+            self.address, addr, index, value, seq=seq), timeout)
+
+    async def poll_class(self, addr, cls, timeout=None):
+        return await self.request(addr, lambda seq: DnpSimple.DnpAsm.request_class(
+            self.address, addr, cls, seq=seq), timeout)
+
+    async def poll_changes(self, addr, cls=0, timeout=None):
+        '''Poll class cls and return the points changed since the last poll
+
+        as (group, index, value, flag), see DnpPointDelta.
+        '''
+        res = await self.poll_class(addr, cls, timeout)
+        return self.delta.changes(addr, res)
+
+    async def enable_unsolicited(self, addr, classes=(1, 2, 3), timeout=None):
+        return await self.request(addr, lambda seq: DnpSimple.DnpAsm.request_unsolicited(
+            self.address, addr, classes, seq=seq), timeout)
+
+    async def disable_unsolicited(self, addr, classes=(1, 2, 3), timeout=None):
+        return await self.request(addr, lambda seq: DnpSimple.DnpAsm.request_unsolicited(
+            self.address, addr, classes, False, seq=seq), timeout)
+
+    async def sync_time(self, addr, timeout=None):
+        '''Set the clock of outstation addr by the LAN procedure
+
+        The outstation records its time on RECORD_CURRENT_TIME; the time
+        the master sent it is then written as last recorded time (50/3)
+        and the outstation adds the time elapsed since.
+        '''
+        sent = []
+        def record(seq):
+            sent.append(DnpSimple.dnp_time())
+            return DnpSimple.DnpAsm.request_record_current_time(self.address, addr, seq=seq)
+        await self.request(addr, record, timeout)
+        return await self.request(addr, lambda seq: DnpSimple.DnpAsm.request_time(
+            self.address, addr, sent[-1], seq=seq), timeout)
+
+    def schedule(self, interval, poll, *args):
+        '''Run await poll(*args) every interval seconds until close()
+
+        Polls of different outstations run concurrently. A poll that
+        fails or times out is counted in self.poll_errors and retried
+        at the next interval.
+        '''
+        async def run():
+            while True:
+                try:
+                    await poll(*args)
+                except (asyncio.TimeoutError, EOFError, OSError, DnpSimple.DnpError):
+                    self.poll_errors += 1
+                await asyncio.sleep(interval)
+        task = asyncio.ensure_future(run())
+        self.polls.append(task)
+        return task
+
+async def main():
+    master = DnpAsyncMaster()
+    await master.add_outstation(123, 'localhost', 20000)
+
+    # Write to Analog Out, then read it back
+    await master.write_analog_out(123, 0, 12345)
+    value = await master.read_analog_out_status(123, 0)
+    print('AO[0] = {}'.format(value))
+
+    await master.close()
+
+if __name__ == '__main__':
+    asyncio.run(main())
+    sys.exit(0)
+
+# Local Variables:
+# compile-command: "python DnpSimpleAsyncMaster.py"
+# End:
@@ -0,0 +1,239 @@
+#!/usr/bin/python
+
+# Benchmarks of DnpSimple
+#     - builders (DnpAsm), decoding (DnpDisasm, DnpReassembler, DnpFramer)
+#       and CRC, in calls and bytes per second with peak memory
+#     - round-trip latency of a master and an outstation over loopback TCP
+#
+# Results are written as JSON, to compare revisions with
+#     python DnpSimpleBench.py compare old.json new.json
+
+import DnpSimple
+from DnpSimple import DnpAsm
+from DnpSimpleAsyncMaster import DnpAsyncMaster
+from DnpSimpleOutstation import DnpOutstation
+import asyncio
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+def bench(name, fn, size=0, min_time=0.2):
+    '''Time fn() and return its result record
+
+    fn is repeated for at least min_time seconds; size is the bytes
+    handled per call. Peak memory of one call is measured separately,
+    as tracemalloc slows everything down.
+    '''
+    calls = 0
+    batch = 1
+    start = time.perf_counter()
+    while True:
+        for k in range(batch):
+            fn()
+        calls += batch
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        batch *= 2
+
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'name': name,
+        'calls': calls,
+        'seconds': elapsed,
+        'calls_per_second': calls / elapsed,
+        'bytes_per_second': calls * size / elapsed,
+        'peak_memory': peak,
+    }
+
+def builder_benchmarks(min_time):
+    # Each DnpAsm builder, and range responses of a few and of many points
+    small = list(range(10))
+    large = list(range(2000))
+    cases = [
+        ('request_class', lambda: DnpAsm.request_class(0, 123, 1, seq=3)),
+        ('request_confirm', lambda: DnpAsm.request_confirm(0, 123, 0, seq=3)),
+        ('request_analog_in', lambda: DnpAsm.request_analog_in(0, 123, 7, seq=3)),
+        ('request_analog_out_status', lambda: DnpAsm.request_analog_out_status(0, 123, 7, seq=3)),
+        ('request_binary_in', lambda: DnpAsm.request_binary_in(0, 123, 7, seq=3)),
+        ('request_analog_out', lambda: DnpAsm.request_analog_out(0, 123, 7, 12345, seq=3)),
+        ('request_deadband', lambda: DnpAsm.request_deadband(0, 123, 7, 10, seq=3)),
+        ('request_unsolicited', lambda: DnpAsm.request_unsolicited(0, 123, (1, 2, 3), seq=3)),
+        ('request_record_current_time', lambda: DnpAsm.request_record_current_time(0, 123, seq=3)),
+        ('request_time', lambda: DnpAsm.request_time(0, 123, 1700000000000, seq=3)),
+        ('response_analog_out', lambda: DnpAsm.response_analog_out(123, 0, 7, 12345, seq=3)),
+        ('response_analog_out_status', lambda: DnpAsm.response_analog_out_status(123, 0, 7, 12345, seq=3)),
+    ]
+    for label, points in (('small', small), ('large', large)):
+        flags = [0x01] * len(points)
+        cases += [
+            ('response_binary_in_range/' + label, lambda points=points, flags=flags:
+                DnpAsm.response_binary_in_range(123, 0, 0, [p & 1 for p in points], flags)),
+            ('response_binary_in_packed/' + label, lambda points=points:
+                DnpAsm.response_binary_in_packed(123, 0, 0, [p & 1 for p in points])),
+            ('response_analog_in_range/' + label, lambda points=points, flags=flags:
+                DnpAsm.response_analog_in_range(123, 0, 0, points, flags)),
+            ('response_analog_out_status_range/' + label, lambda points=points, flags=flags:
+                DnpAsm.response_analog_out_status_range(123, 0, 0, points, flags)),
+        ]
+    results = []
+    for name, fn in cases:
+        size = len(fn())
+        results.append(bench('build/' + name, fn, size, min_time))
+    return results
+
+def decode_benchmarks(min_time):
+    # Single frame and multi-segment fragments, framing and validation
+    results = []
+    request = DnpAsm.request_analog_out(0, 123, 7, 12345)
+    small = DnpAsm.response_analog_in_range(123, 0, 0, list(range(10)), [1] * 10)
+    large = DnpAsm.response_analog_in_range(123, 0, 0, list(range(2000)), [1] * 2000)
+
+    def decode(frame):
+        res = DnpSimple.DnpDisasm(frame, quiet=True)
+        for obj in res.objects:
+            pass
+        return res
+    results.append(bench('decode/request', lambda: decode(request), len(request), min_time))
+    results.append(bench('decode/small', lambda: decode(small), len(small), min_time))
+    DnpSimple.enable_decode_cache()
+    results.append(bench('decode/small_cached', lambda: decode(small), len(small), min_time))
+    DnpSimple.disable_decode_cache()
+
+    # Multi-segment fragment through the framer and reassembler
+    def reassemble():
+        framer = DnpSimple.DnpFramer(65536)
+        reassembler = DnpSimple.DnpReassembler(quiet=True)
+        for frame in framer.feed(large):
+            res = reassembler.feed(frame)
+            if res is not None:
+                for obj in res.objects:
+                    pass
+    results.append(bench('decode/large', reassemble, len(large), min_time))
+
+    def render():
+        return DnpSimple.DnpDisasm(small, quiet=True).render()
+    results.append(bench('render/small', render, len(small), min_time))
+
+    stream = bytes(large) * 16
+    def frames():
+        framer = DnpSimple.DnpFramer(65536)
+        for frame in framer.feed(stream):
+            pass
+    results.append(bench('framer', frames, len(stream), min_time))
+    results.append(bench('validate_frames', lambda: DnpSimple.validate_frames(stream),
+                         len(stream), min_time))
+    return results
+
+def crc_benchmarks(min_time):
+    block = bytes(range(256)) * 64
+    frame = DnpAsm.response_analog_in_range(123, 0, 0, list(range(50)), [1] * 50)
+    return [
+        bench('crc16_dnp/16', lambda: DnpSimple.crc16_dnp(block, 0, 16), 16, min_time),
+        bench('crc16_dnp/16k', lambda: DnpSimple.crc16_dnp(block), len(block), min_time),
+        bench('verify_frame', lambda: DnpSimple.verify_frame(frame), len(frame), min_time),
+    ]
+
+def percentile(samples, p):
+    # samples sorted
+    return samples[min(len(samples) - 1, int(p / 100.0 * len(samples)))]
+
+async def loopback_benchmark(requests):
+    '''Round-trip latency of reads and class polls over loopback TCP'''
+    outstation = DnpOutstation(123)
+    server = await outstation.serve('127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    master = DnpAsyncMaster()
+    await master.add_outstation(123, '127.0.0.1', port)
+
+    results = []
+    cases = (
+        ('read_analog_in', lambda: master.read_analog_in(123, 0)),
+        ('poll_class0', lambda: master.poll_class(123, 0)),
+    )
+    for name, fn in cases:
+        for k in range(10):  # warm up
+            await fn()
+        samples = []
+        start = time.perf_counter()
+        for k in range(requests):
+            t = time.perf_counter()
+            await fn()
+            samples.append(time.perf_counter() - t)
+        elapsed = time.perf_counter() - start
+        samples.sort()
+        results.append({
+            'name': 'loopback/' + name,
+            'calls': requests,
+            'seconds': elapsed,
+            'calls_per_second': requests / elapsed,
+            'latency_p50': percentile(samples, 50),
+            'latency_p90': percentile(samples, 90),
+            'latency_p99': percentile(samples, 99),
+            'latency_max': samples[-1],
+        })
+
+    await master.close()
+    server.close()
+    await server.wait_closed()
+    return results
+
+def run(min_time=0.2, requests=1000):
+    '''Run all benchmarks, return the report as a dict'''
+    results = []
+    results += builder_benchmarks(min_time)
+    results += decode_benchmarks(min_time)
+    results += crc_benchmarks(min_time)
+    results += asyncio.run(loopback_benchmark(requests))
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.time(),
+        'results': results,
+    }
+
+def compare(old, new):
+    '''Return lines comparing calls per second of two reports'''
+    before = dict((result['name'], result) for result in old['results'])
+    lines = []
+    for result in new['results']:
+        base = before.get(result['name'])
+        if base is None:
+            continue
+        ratio = result['calls_per_second'] / base['calls_per_second']
+        lines.append('{:45s} {:12.0f} {:12.0f} {:6.2f}x'.format(
+            result['name'], base['calls_per_second'], result['calls_per_second'], ratio))
+    return lines
+
+def main(argv):
+    if len(argv) > 3 and argv[1] == 'compare':
+        with open(argv[2]) as f:
+            old = json.load(f)
+        with open(argv[3]) as f:
+            new = json.load(f)
+        for line in compare(old, new):
+            print(line)
+        return 0
+    report = run()
+    text = json.dumps(report, indent=1)
+    if len(argv) > 1:
+        with open(argv[1], 'w') as f:
+            f.write(text)
+        for result in report['results']:
+            print('{:45s} {:12.0f}/s'.format(result['name'], result['calls_per_second']))
+    else:
+        print(text)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
+
+# Local Variables:
+# compile-command: "python DnpSimpleBench.py bench.json"
+# End:
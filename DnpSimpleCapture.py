@@ -0,0 +1,364 @@
+#!/usr/bin/python
+
+# Offline decoder for DNP captures
+#     - DnpCaptureDecoder: fragments and points of a pcap or hex-line
+#       capture, memory-mapped and decoded as a stream
+#     - DnpPointColumns: decoded points as columns, written as CSV or .npz
+#     - decode_parallel(): the same, sharded across a process pool
+
+import DnpSimple
+from array import array
+import csv
+import mmap
+import multiprocessing
+import struct
+import sys
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Byte order and time unit of a pcap file, by magic number
+_PCAP_MAGIC = {
+    b'\xd4\xc3\xb2\xa1': ('<', 1e-6),
+    b'\xa1\xb2\xc3\xd4': ('>', 1e-6),
+    b'\x4d\x3c\xb2\xa1': ('<', 1e-9),  # nanosecond resolution
+    b'\xa1\xb2\x3c\x4d': ('>', 1e-9),
+}
+_PCAP_HEADER_SIZE = 24
+
+# Offset of the network layer and of its protocol field, by link type
+_LINK_TYPES = {
+    0: (4, None),  # loopback, family in host order
+    1: (14, 12),  # ethernet
+    12: (0, None),  # raw IP
+    101: (0, None),  # raw IP
+    113: (16, 14),  # linux cooked
+}
+
+def pcap_packets(data):
+    '''Yield (time, flow, payload) of the TCP and UDP packets of a pcap
+
+    flow is (source address, source port, destination address,
+    destination port) with addresses as integers, payload a memoryview
+    into data. IPv4 and IPv6 over ethernet (with VLAN tags), linux
+    cooked and raw IP captures are understood; IP fragments and IPv6
+    extension headers are not.
+    '''
+    view = memoryview(data)
+    order, unit = _PCAP_MAGIC[bytes(view[0:4])]
+    linktype = struct.unpack_from(order + 'I', view, 20)[0]
+    if linktype not in _LINK_TYPES:
+        raise DnpSimple.DnpError('pcap link type {} not supported'.format(linktype))
+    network, ethertype = _LINK_TYPES[linktype]
+    record = struct.Struct(order + 'IIII')
+    total = len(view)
+    p = _PCAP_HEADER_SIZE
+    while p + 16 <= total:
+        sec, frac, caplen, origlen = record.unpack_from(view, p)
+        p += 16
+        packet = view[p:p + caplen]
+        p += caplen
+
+        # Network layer
+        q = network
+        if ethertype is not None:
+            kind = (packet[ethertype] << 8) | packet[ethertype + 1]
+            if kind == 0x8100:  # VLAN tag
+                kind = (packet[ethertype + 4] << 8) | packet[ethertype + 5]
+                q += 4
+            if kind not in (0x0800, 0x86dd):
+                continue
+        if len(packet) < q + 20:
+            continue
+        version = packet[q] >> 4
+        if version == 4:
+            length = (packet[q + 2] << 8) | packet[q + 3]
+            protocol = packet[q + 9]
+            src = int.from_bytes(packet[q + 12:q + 16], 'big')
+            dst = int.from_bytes(packet[q + 16:q + 20], 'big')
+            end = q + length
+            q += (packet[q] & 0x0f) * 4
+        elif version == 6:
+            length = (packet[q + 4] << 8) | packet[q + 5]
+            protocol = packet[q + 6]
+            src = int.from_bytes(packet[q + 8:q + 24], 'big')
+            dst = int.from_bytes(packet[q + 24:q + 40], 'big')
+            q += 40
+            end = q + length
+        else:
+            continue
+
+        # Transport layer
+        if protocol == 6 and len(packet) >= q + 20:  # TCP
+            header = (packet[q + 12] >> 4) * 4
+        elif protocol == 17 and len(packet) >= q + 8:  # UDP
+            header = 8
+        else:
+            continue
+        sport = (packet[q] << 8) | packet[q + 1]
+        dport = (packet[q + 2] << 8) | packet[q + 3]
+        payload = packet[q + header:min(end, len(packet))]
+        if len(payload):
+            yield sec + frac * unit, (src, sport, dst, dport), payload
+
+def hex_packets(data, start=0, stop=None):
+    '''Yield (None, direction, payload) of each '>' and '<' line of data
+
+    in the format DnpDisasm prints, starting at the line at start up
+    to the line holding stop. Other lines are skipped.
+    '''
+    if stop is None:
+        stop = len(data)
+    p = start
+    while p < stop:
+        q = data.find(b'\n', p)
+        if q < 0:
+            q = len(data)
+        line = data[p:q].strip()
+        p = q + 1
+        direction = line[:1]
+        if direction == b'>' or direction == b'<':
+            try:
+                payload = bytes.fromhex(line[1:].decode('ascii'))
+            except (UnicodeDecodeError, ValueError):
+                continue
+            yield None, direction, payload
+
+def hex_shard(data, shard, shards):
+    '''Return (start, stop) of one of shards parts of a hex-line capture
+
+    Parts begin at a request line, so no fragment is split.
+    '''
+    def boundary(p):
+        if p == 0:
+            return 0
+        q = data.find(b'\n>', p)
+        return len(data) if q < 0 else q + 1
+    size = len(data)
+    return boundary(size * shard // shards), boundary(size * (shard + 1) // shards)
+
+class DnpPointColumns(object):
+    '''Decoded points as one typed array per column
+
+    A point without time (hex-line captures) has time NaN, one without
+    flag has flag -1. Values are stored as doubles, which hold 32bit
+    integers exactly.
+    '''
+    names = ('time', 'source', 'destination', 'function', 'group',
+             'variation', 'index', 'value', 'flag')
+    typecodes = ('d', 'H', 'H', 'B', 'B', 'B', 'I', 'd', 'h')
+
+    def __init__(self):
+        for name, code in zip(self.names, self.typecodes):
+            setattr(self, name, array(code))
+
+    def __len__(self):
+        return len(self.index)
+
+    def columns(self):
+        return [getattr(self, name) for name in self.names]
+
+    def add(self, when, res):
+        # Append the points of the DnpDisasm res
+        if when is None:
+            when = float('nan')
+        for obj in res.objects:
+            if obj.index is None or (obj.value is None and obj.flag is None):
+                continue
+            n = len(obj.index)
+            self.time.extend(array('d', [when]) * n)
+            self.source.extend(array('H', [res.link_source]) * n)
+            self.destination.extend(array('H', [res.link_destination]) * n)
+            self.function.extend(array('B', [res.application_function]) * n)
+            self.group.extend(array('B', [obj.group]) * n)
+            self.variation.extend(array('B', [obj.variation]) * n)
+            self.index.fromlist(obj.index.tolist())
+            if obj.value is not None:
+                self.value.fromlist(obj.value.tolist())
+            else:
+                self.value.extend(array('d', [0.0]) * n)
+            if obj.flag is not None:
+                self.flag.fromlist(obj.flag.tolist())
+            else:
+                self.flag.extend(array('h', [-1]) * n)
+
+    def extend(self, other):
+        for name in self.names:
+            getattr(self, name).extend(getattr(other, name))
+
+    def write_csv(self, path):
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(self.names)
+            value = [int(v) if v.is_integer() else v for v in self.value]
+            columns = self.columns()
+            columns[self.names.index('value')] = value
+            writer.writerows(zip(*columns))
+
+    def write_npz(self, path):
+        if numpy is None:
+            raise ImportError('numpy is needed to write .npz files')
+        numpy.savez_compressed(path, **dict(
+            (name, numpy.frombuffer(column, dtype=column.typecode))
+            for name, column in zip(self.names, self.columns())))
+
+    def write(self, path):
+        '''Write as .npz if path ends so, as CSV otherwise'''
+        if path.endswith('.npz'):
+            self.write_npz(path)
+        else:
+            self.write_csv(path)
+
+class DnpCaptureDecoder(object):
+    '''Decode the DNP traffic of a capture file
+
+    The file is memory-mapped, and its packets are streamed through a
+    DnpFramer and a DnpReassembler per TCP/UDP flow (per direction for
+    hex-line captures), so memory use does not grow with its size.
+
+        decoder = DnpCaptureDecoder('day.pcap')
+        for when, res in decoder.fragments():
+            ...
+        decoder.points().write('day.csv')
+
+    With shards > 1 only part shard of the capture is decoded: the
+    flows hashing to it for pcap, a range of lines for hex-line.
+    '''
+    def __init__(self, path, shard=0, shards=1):
+        self.path = path
+        self.shard = shard
+        self.shards = shards
+        self.file = open(path, 'rb')
+        try:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            self.data = b''
+        self.packets = 0
+        self.frames = 0
+        self.crc_errors = 0
+        self.malformed = 0
+        self.discarded = 0
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def capture_packets(self):
+        data = self.data
+        shard = self.shard
+        shards = self.shards
+        if bytes(data[0:4]) in _PCAP_MAGIC:
+            for when, flow, payload in pcap_packets(data):
+                if shards == 1 or hash(flow) % shards == shard:
+                    yield when, flow, payload
+        else:
+            start, stop = hex_shard(data, shard, shards)
+            for packet in hex_packets(data, start, stop):
+                yield packet
+
+    def fragments(self):
+        '''Yield (time, res) of each fragment, res a quiet DnpDisasm'''
+        flows = {}
+        try:
+            for when, flow, payload in self.capture_packets():
+                self.packets += 1
+                decoders = flows.get(flow)
+                if decoders is None:
+                    decoders = flows[flow] = (
+                        DnpSimple.DnpFramer(65536),
+                        DnpSimple.DnpReassembler(quiet=True, strict=True))
+                framer, reassembler = decoders
+                for frame in framer.feed(payload):
+                    self.frames += 1
+                    if frame[2] <= 5 or frame[3] & 0x4f not in (0x43, 0x44):
+                        continue  # link layer only: not primary user data
+                    try:
+                        res = reassembler.feed(frame)
+                    except DnpSimple.DnpCrcError:
+                        self.crc_errors += 1
+                        continue
+                    except IndexError:  # headers cut short
+                        self.malformed += 1
+                        continue
+                    if res is not None:
+                        yield when, res
+        finally:
+            self.discarded += sum(framer.discarded for framer, reassembler in flows.values())
+
+    def points(self, responses_only=True):
+        '''Return the DnpPointColumns of the points of all fragments
+
+        Objects that cannot be decoded are skipped, and their fragments
+        counted as malformed.
+        '''
+        points = DnpPointColumns()
+        for when, res in self.fragments():
+            if responses_only and res.iin is None:
+                continue
+            try:
+                objects = res.objects
+            except (IndexError, ValueError):
+                self.malformed += 1
+                continue
+            if any(obj.error for obj in objects):
+                self.malformed += 1
+            points.add(when, res)
+        return points
+
+    def stats(self):
+        return {'packets': self.packets, 'frames': self.frames,
+                'crc_errors': self.crc_errors, 'malformed': self.malformed,
+                'discarded': self.discarded}
+
+def _decode_shard(args):
+    path, shard, shards = args
+    with DnpCaptureDecoder(path, shard, shards) as decoder:
+        points = decoder.points()
+        return points, decoder.stats()
+
+def decode_parallel(path, processes=None):
+    '''Return (points, stats) of a capture decoded by a process pool
+
+    The capture is split into one shard per process, see
+    DnpCaptureDecoder. Rows of each shard stay in capture order.
+    '''
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    shards = [(path, shard, processes) for shard in range(processes)]
+    if processes == 1:
+        return _decode_shard(shards[0])
+    points = DnpPointColumns()
+    stats = {}
+    with multiprocessing.Pool(processes) as pool:
+        for part, counts in pool.imap(_decode_shard, shards):
+            points.extend(part)
+            for key, value in counts.items():
+                stats[key] = stats.get(key, 0) + value
+    return points, stats
+
+def main(argv):
+    if len(argv) < 3:
+        print('usage: {} CAPTURE OUTPUT.csv|OUTPUT.npz [PROCESSES]'.format(argv[0]))
+        return 2
+    start = time.time()
+    points, stats = decode_parallel(argv[1], int(argv[3]) if len(argv) > 3 else None)
+    points.write(argv[2])
+    print('{} points, {} in {:.1f}s'.format(len(points), stats, time.time() - start))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
+
+# Local Variables:
+# compile-command: "python DnpSimpleCapture.py capture.pcap points.csv"
+# End:
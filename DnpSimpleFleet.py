@@ -0,0 +1,227 @@
+#!/usr/bin/python
+
+# Simulated outstation fleet for load testing masters
+#     - DnpFleet: many outstations in one process, on many ports or
+#       behind link addresses of one port, changing points at set rates
+#     - replay(): play recorded frames at original or scaled timing
+
+import DnpSimple
+from DnpSimpleOutstation import DnpOutstation, DnpOutstationProtocol, DnpPointDatabase
+import DnpSimpleCapture
+import asyncio
+import random
+import sys
+import time
+
+class DnpFleetPort(object):
+    '''Outstations sharing one port, selected by link destination
+
+    Stands in for the outstation of a DnpOutstationProtocol. Unsolicited
+    responses are not pushed through a shared port.
+    '''
+    def __init__(self, outstations):
+        self.outstations = dict((outstation.address, outstation) for outstation in outstations)
+        self.sessions = set()
+        self.unsolicited = {}
+
+    def route(self, req):
+        return self.outstations.get(req.link_destination)
+
+class DnpFleet(object):
+    '''Many simulated outstations in one process
+
+    Outstations get link addresses first_address.. and are spread over
+    ports consecutive TCP ports from port; with as many ports as
+    outstations each one has its own port, otherwise requests on a port
+    are routed by link destination. Each outstation has a small
+    DnpPointDatabase of its own, as its points change independently and
+    it buffers its own events; with the default 16 points per type and
+    64 events that is a few kilobytes of typed arrays per outstation.
+    All share one handler table.
+
+        fleet = DnpFleet(1000)
+        await fleet.serve(port=20000, ports=10)
+        fleet.simulate(analog_inputs=1.0, binary_inputs=0.1)
+    '''
+    def __init__(self, count, first_address=1, binary_inputs=16, analog_inputs=16,
+                 analog_outputs=16, event_capacity=64, seed=None):
+        handlers = None
+        self.outstations = []
+        for address in range(first_address, first_address + count):
+            outstation = DnpOutstation(address, DnpPointDatabase(
+                binary_inputs, analog_inputs, analog_outputs, event_capacity))
+            if handlers is None:
+                handlers = outstation.handlers
+            outstation.handlers = handlers
+            self.outstations.append(outstation)
+        self.random = random.Random(seed)
+        self.servers = []
+        self.tasks = []
+        self.changes = 0
+
+    async def serve(self, host='', port=20000, ports=1):
+        '''Listen on ports ports from port, return the asyncio servers'''
+        loop = asyncio.get_event_loop()
+        count = len(self.outstations)
+        ports = min(ports, count)
+        for k in range(ports):
+            group = self.outstations[k * count // ports:(k + 1) * count // ports]
+            if len(group) == 1:
+                server = await group[0].serve(host, port + k)
+            else:
+                front = DnpFleetPort(group)
+                server = await loop.create_server(
+                    lambda front=front: DnpOutstationProtocol(front), host, port + k)
+            self.servers.append(server)
+        return self.servers
+
+    def change(self, outstation, table, index):
+        # Toggle a binary point, or move an analog one by a random step
+        points = getattr(outstation.database, table)
+        if points.typecode == 'B':
+            value = points.values[index] ^ 1
+        else:
+            value = points.values[index] + self.random.randint(-100, 100)
+        outstation.database.update(table, index, value)
+        self.changes += 1
+
+    def simulate(self, interval=0.1, **rates):
+        '''Change points at rates[table] changes per second per outstation
+
+        e.g. simulate(analog_inputs=1.0, binary_inputs=0.1). Points to
+        change are drawn at random from the whole fleet every interval
+        seconds, so the cost follows the rate, not the fleet size.
+        '''
+        count = len(self.outstations)
+        async def run():
+            due = dict((table, 0.0) for table in rates)
+            last = time.monotonic()
+            while True:
+                await asyncio.sleep(interval)
+                now = time.monotonic()
+                elapsed = now - last
+                last = now
+                for table, rate in rates.items():
+                    due[table] += rate * count * elapsed
+                    n = int(due[table])
+                    due[table] -= n
+                    for k in range(n):
+                        outstation = self.outstations[self.random.randrange(count)]
+                        size = len(getattr(outstation.database, table))
+                        if size:
+                            self.change(outstation, table, self.random.randrange(size))
+        task = asyncio.ensure_future(run())
+        self.tasks.append(task)
+        return task
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        for server in self.servers:
+            server.close()
+            await server.wait_closed()
+        self.servers = []
+
+def recorded_frames(path, sources=None, responses=False):
+    '''Return [(time, frame)] of the frames of a capture file
+
+    Only the frames of masters are kept, unless responses: a flow is
+    taken for an outstation's once it carries a response, as the DIR
+    bit is not set reliably by every station. sources, if given, keeps
+    only frames from these link addresses. Hex-line captures have no
+    time, their frames get time None.
+    '''
+    frames = []
+    with DnpSimpleCapture.DnpCaptureDecoder(path) as decoder:
+        framers = {}
+        outstation = {}  # flow -> carries responses
+        for when, flow, payload in decoder.capture_packets():
+            framer = framers.get(flow)
+            if framer is None:
+                framer = framers[flow] = DnpSimple.DnpFramer(65536)
+            for frame in framer.feed(payload):
+                if frame[2] > 7 and frame[10] & 0x40:  # FIR segment, function at 12
+                    outstation[flow] = frame[12] >= DnpSimple.Function.RESPONSE
+                if not responses and outstation.get(flow, False):
+                    continue
+                if sources is not None and frame[6] | (frame[7] << 8) not in sources:
+                    continue  # link source
+                frames.append((when, bytes(frame)))
+            payload = None  # release the view of the mapping
+    return frames
+
+async def replay(frames, write, scale=1.0, interval=0.0):
+    '''Write recorded frames with write(), keeping their timing
+
+    Gaps between frame times are multiplied by scale (0 sends as fast
+    as possible); frames without time are sent interval seconds apart.
+    Return the number of frames sent.
+    '''
+    loop = asyncio.get_event_loop()
+    start = loop.time()
+    first = None
+    offset = 0.0
+    for when, frame in frames:
+        if when is None:
+            offset += interval
+        else:
+            if first is None:
+                first = when
+            offset = (when - first) * scale
+        delay = start + offset - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        write(frame)
+    return len(frames)
+
+async def replay_to(path, host, port, scale=1.0, sources=None, interval=0.0):
+    '''Replay the requests of a capture file to host:port over TCP
+
+    sources selects masters by link address, see recorded_frames().
+    '''
+    frames = recorded_frames(path, sources)
+    reader, writer = await asyncio.open_connection(host, port)
+    async def drain():
+        while await reader.read(65536):
+            pass
+    task = asyncio.ensure_future(drain())  # responses are discarded
+    try:
+        return await replay(frames, writer.write, scale, interval)
+    finally:
+        await writer.drain()
+        task.cancel()
+        writer.close()
+
+async def main(count, port, ports):
+    fleet = DnpFleet(count)
+    await fleet.serve(port=port, ports=ports)
+    fleet.simulate(analog_inputs=1.0, binary_inputs=0.1)
+    print('{} DNP outstations listening on ports {}-{}'.format(
+        count, port, port + min(ports, count) - 1))
+    while True:
+        await asyncio.sleep(10)
+        print('{} changes'.format(fleet.changes))
+
+if __name__ == '__main__':
+    try:
+        if len(sys.argv) > 1 and sys.argv[1] == 'replay':
+            # replay CAPTURE HOST PORT [SCALE [SOURCE,...]]
+            sources = None
+            if len(sys.argv) > 6:
+                sources = set(int(source) for source in sys.argv[6].split(','))
+            sent = asyncio.run(replay_to(sys.argv[2], sys.argv[3], int(sys.argv[4]),
+                                         float(sys.argv[5]) if len(sys.argv) > 5 else 1.0,
+                                         sources))
+            print('{} frames sent'.format(sent))
+        else:
+            # [COUNT [PORT [PORTS]]]
+            args = [int(arg) for arg in sys.argv[1:4]]
+            args += [100, 20000, 1][len(args):]
+            asyncio.run(main(*args))
+    except KeyboardInterrupt:
+        pass
+    sys.exit(0)
+
+# Local Variables:
+# compile-command: "python DnpSimpleFleet.py 100 20000 10"
+# End:
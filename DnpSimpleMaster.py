@@ -7,24 +7,31 @@ import sys
 # Connect to TCP server
 client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 client.connect(('localhost', 20000))
+framer = DnpSimple.DnpFramer()
+
+def receive():
+    # Receive until the framer has a complete response frame
+    while True:
+        for frame in framer.frames():
+            return DnpSimple.DnpDisasm(frame)
+        if not framer.recv(client):
+            raise EOFError('DNP slave disconnected')
 
 # Write to Analog Out
 txdata = DnpSimple.DnpAsm.request_analog_out(
     src=0, dst=123, index=0, value=12345)
 req = DnpSimple.DnpDisasm(txdata, request=True)
-client.send(txdata)
+client.sendall(txdata)
 
-rxdata = bytearray(client.recv(512))
-res = DnpSimple.DnpDisasm(rxdata)
+res = receive()
 
 # Read back from Analog Out
 txdata = DnpSimple.DnpAsm.request_analog_out_status(
     src=0, dst=123, index=0)
 req = DnpSimple.DnpDisasm(txdata, request=True)
-client.send(txdata)
+client.sendall(txdata)
 
-rxdata = bytearray(client.recv(512))
-res = DnpSimple.DnpDisasm(rxdata)
+res = receive()
 
 # Close TCP
 client.close()
@@ -0,0 +1,693 @@
+#!/usr/bin/python
+
+# Concurrent DNP outstation
+#     - DnpPointDatabase: point values shared by all sessions, with
+#       class 1-3 event buffers
+#     - DnpOutstation: serves many masters at once over asyncio and
+#       pushes events as unsolicited responses
+
+import DnpSimple
+from DnpSimple import Function, IIN
+from array import array
+import asyncio
+import struct
+import sys
+import threading
+import time
+
+_IIN = struct.Struct('<H')
+_IIN_OFFSET = 11  # link header, transport header, application header
+_OBJECTS_OFFSET = _IIN_OFFSET + 2
+
+class DnpPointTable(object):
+    '''Points of one type as a value column and a flag column
+
+    Changes of points in event class 1, 2 or 3 (self.classes, 0 for
+    none) are reported as events of event_group/event_variation when
+    they move more than self.deadbands from the last reported value.
+
+    columns, if given, are the existing (values, flags, classes,
+    deadbands, reported) columns to use, such as memoryviews of a
+    DnpPointStore, instead of new arrays.
+    '''
+    columns = ('values', 'flags', 'classes', 'deadbands', 'reported')
+
+    def __init__(self, count, typecode, event_group=None, event_variation=1, event_class=0,
+                 columns=None):
+        self.typecode = typecode
+        self.event_group = event_group
+        self.event_variation = event_variation
+        if columns is not None:
+            self.values, self.flags, self.classes, self.deadbands, self.reported = columns
+            return
+        self.values = array(typecode, [0]) * count
+        self.flags = array('B', [0x01]) * count  # online
+        self.classes = array('B', [event_class if event_group else 0]) * count
+        self.deadbands = array('I', [0]) * count
+        self.reported = array(typecode, [0]) * count  # value of the last event
+
+    def __len__(self):
+        return len(self.flags)
+
+    def gather(self, indices):
+        # Return (values, flags) of the points at indices
+        values = self.values
+        flags = self.flags
+        return (array(self.typecode, [values[i] for i in indices]),
+                array('B', [flags[i] for i in indices]))
+
+class DnpEventBuffer(object):
+    '''Bounded ring of the events of one class
+
+    Events are kept as columns of typed arrays: group, index, value,
+    flag and time (DNP time, see DnpSimple.dnp_time()). When the ring is full the oldest event is dropped and
+    self.overflow is set until the master reads the buffer. Events are
+    numbered from self.first, the oldest one, so events sent with
+    peek() can be released once confirmed even if some were read
+    meanwhile.
+    '''
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.groups = array('B', [0]) * capacity
+        self.indices = array('H', [0]) * capacity
+        self.values = array('i', [0]) * capacity
+        self.flags = array('B', [0]) * capacity
+        self.times = array('q', [0]) * capacity
+        self.head = 0
+        self.count = 0
+        self.first = 0
+        self.overflow = False
+
+    def __len__(self):
+        return self.count
+
+    def push(self, group, index, value, flag, time=0):
+        capacity = self.capacity
+        if self.count == capacity:
+            # Drop the oldest event
+            self.head = (self.head + 1) % capacity
+            self.count -= 1
+            self.first += 1
+            self.overflow = True
+        i = (self.head + self.count) % capacity
+        self.groups[i] = group
+        self.indices[i] = index
+        self.values[i] = value
+        self.flags[i] = flag
+        self.times[i] = time
+        self.count += 1
+
+    def peek(self, limit=None):
+        '''Return the oldest limit events as (groups, indices, values, flags, times)
+
+        and the number of the event after them, for release().
+        '''
+        count = self.count if limit is None else min(self.count, limit)
+        capacity = self.capacity
+        head = self.head
+        end = head + count
+        columns = []
+        for column in (self.groups, self.indices, self.values, self.flags, self.times):
+            if end <= capacity:
+                columns.append(column[head:end])
+            else:  # wraps around
+                columns.append(column[head:] + column[:end - capacity])
+        return columns, self.first + count
+
+    def release(self, upto):
+        # Remove the events numbered below upto
+        count = min(max(upto - self.first, 0), self.count)
+        if count:
+            self.head = (self.head + count) % self.capacity
+            self.count -= count
+            self.first += count
+            self.overflow = False  # there is room again
+
+    def drain(self, limit=None):
+        '''Remove the oldest limit events, return (groups, indices, values, flags, times)'''
+        columns, upto = self.peek(limit)
+        self.release(upto)
+        return columns
+
+class DnpPointDatabase(object):
+    '''Point values shared by all sessions of an outstation
+
+    Each point type is a DnpPointTable of typed arrays, so whole ranges
+    are packed into responses with slice operations. Hold self.lock
+    while reading or updating more than one point, so other threads may
+    change points while requests are being served.
+
+    update() records events in self.events, one DnpEventBuffer per
+    class. By default binary inputs are class 1 and analog inputs
+    class 2; analog outputs report no events. Each of self.listeners is
+    called with the class of every new event. Events are stamped with
+    now(), the time of the outstation clock, unless update() is given
+    the time of the change.
+
+    With a DnpPointStore, its memory-mapped tables are used instead and
+    the point counts are those of the store. Events are not stored.
+    '''
+    # name, typecode, event group, event variation and default class
+    tables = (
+        ('binary_inputs', 'B', 2, 1, 1),  # event without time
+        ('analog_inputs', 'i', 32, 1, 2),  # 32bit event
+        ('analog_outputs', 'i', 42, 1, 0),  # 32bit event
+    )
+
+    def __init__(self, binary_inputs=16, analog_inputs=16, analog_outputs=16,
+                 event_capacity=1024, store=None):
+        self.lock = threading.RLock()
+        counts = (binary_inputs, analog_inputs, analog_outputs)
+        for count, (name, code, group, variation, cls) in zip(counts, self.tables):
+            if store is not None:
+                table = getattr(store, name)
+            else:
+                table = DnpPointTable(count, code, group, variation, cls)
+            setattr(self, name, table)
+        self.store = store
+        self.time_offset = 0  # of the outstation clock, in milliseconds
+        self.events = dict((cls, DnpEventBuffer(event_capacity)) for cls in (1, 2, 3))
+        self.listeners = []
+
+    def now(self):
+        return DnpSimple.dnp_time() + self.time_offset
+
+    def update(self, table, index, value, flag=None, when=None):
+        with self.lock:
+            table = getattr(self, table)
+            changed = False
+            if flag is not None and flag != table.flags[index]:
+                table.flags[index] = flag
+                changed = True
+            table.values[index] = value
+            cls = table.classes[index]
+            if cls and (changed or abs(value - table.reported[index]) > table.deadbands[index]):
+                table.reported[index] = value
+                if when is None:
+                    when = self.now()
+                self.events[cls].push(table.event_group, index, value, table.flags[index], when)
+                for listener in self.listeners:
+                    listener(cls)
+
+    def event_iin(self):
+        # IIN bits of the pending events
+        iin = 0
+        for cls, bit in ((1, IIN.CLASS1), (2, IIN.CLASS2), (3, IIN.CLASS3)):
+            events = self.events[cls]
+            if events.count:
+                iin |= bit
+            if events.overflow:
+                iin |= IIN.EVENT_BUFFER_OVERFLOW
+        return iin
+
+# Request handlers by (function, group). A handler is called as
+# handler(outstation, obj, res) for each object header of a request,
+# appends its response objects to the DnpAsm res and may return IIN bits.
+HANDLERS = {}
+
+def handler(function, group):
+    def register(fn):
+        HANDLERS[(function, group)] = fn
+        return fn
+    return register
+
+def read_table(outstation, obj, res, table, group, variation):
+    # Append the points an object header asks for, packed in bulk, in as
+    # many objects as it takes to fit the fragments of the response
+    count = len(table)
+    indices = None
+    if obj.ranges == 6:  # all points
+        start, stop = 0, count - 1
+    elif obj.ranges in (0, 1):  # start-stop
+        start, stop = obj.start, obj.stop
+    else:  # indices
+        indices = obj.index or []
+        if any(index >= count for index in indices):
+            return IIN.PARAMETER_ERROR
+        start, stop = 0, len(indices) - 1
+    if indices is None and (stop >= count or start > stop):
+        return IIN.PARAMETER_ERROR if obj.ranges != 6 else 0
+    codec = DnpSimple.CODECS[(group, variation)]
+    if indices is None:
+        header, bits = 7, 8 * codec.record_layout(0)[0] or 1  # 2-octet start, stop
+    else:
+        header, bits = 5, 8 * codec.record_layout(2)[0]  # 2-octet count, indices
+    while start <= stop:
+        n = min(8 * (outstation.room(res) - header) // bits, stop - start + 1)
+        if n < 1:
+            outstation.split(res)
+            continue
+        if indices is None:
+            res.object_points(group, variation, start, value=table.values[start:start + n],
+                              flag=table.flags[start:start + n])
+        else:
+            values, flags = table.gather(indices[start:start + n])
+            res.object_points(group, variation, indices=indices[start:start + n],
+                              value=values, flag=flags)
+        start += n
+    return 0
+
+@handler(Function.READ, 1)
+def read_binary_in(outstation, obj, res):
+    # Packed if asked for (not a class poll) over a range, 8bit with flag otherwise
+    packed = obj.group == 1 and obj.variation == 1 and obj.ranges in (0, 1, 6)
+    variation = 1 if packed else 2
+    return read_table(outstation, obj, res, outstation.database.binary_inputs, 1,
+                      variation)
+
+@handler(Function.READ, 30)
+def read_analog_in(outstation, obj, res):
+    database = outstation.database
+    return read_table(outstation, obj, res, database.analog_inputs, 30, 1)  # 32bit with flag
+
+@handler(Function.READ, 40)
+def read_analog_out_status(outstation, obj, res):
+    database = outstation.database
+    return read_table(outstation, obj, res, database.analog_outputs, 40, 1)  # 32bit with flag
+
+def write_events(res, group, variation, indices, values, flags, times, synchronized=True):
+    # Append events of one group, with a common time of occurrence before
+    # each run of events within 65 seconds if their times are relative;
+    # unsynchronized (51/2) while the clock has not been set
+    codec = DnpSimple.CODECS[(group, variation)]
+    if 'time' not in codec.fields:
+        res.object_points(group, variation, indices=indices, value=values, flag=flags)
+    elif not codec.relative:
+        res.object_points(group, variation, indices=indices, value=values, flag=flags,
+                          time=times)
+    else:
+        count = len(times)
+        k = 0
+        while k < count:
+            cto = times[k]
+            n = k + 1
+            while n < count and 0 <= times[n] - cto <= 0xffff:
+                n += 1
+            res.object_cto(cto, synchronized)
+            res.object_points(group, variation, indices=indices[k:n], value=values[k:n],
+                              flag=flags[k:n], time=array('H', [t - cto for t in times[k:n]]))
+            k = n
+
+def read_events(outstation, res, columns):
+    # Append events of a buffer, one object header per group
+    groups, indices, values, flags, times = columns
+    database = outstation.database
+    for table in (database.binary_inputs, database.analog_inputs, database.analog_outputs):
+        group = table.event_group
+        if groups.count(group) == len(groups):  # all of one group
+            selected = None
+        else:
+            selected = [k for k, g in enumerate(groups) if g == group]
+            if not selected:
+                continue
+        if selected is None:
+            point_indices, point_values, point_flags, point_times = indices, values, flags, times
+        else:
+            point_indices = array('H', [indices[k] for k in selected])
+            point_values = array('i', [values[k] for k in selected])
+            point_flags = array('B', [flags[k] for k in selected])
+            point_times = array('q', [times[k] for k in selected])
+        if group == 2:  # state in flag
+            point_values = array('B', point_values)
+        write_events(res, group, table.event_variation, point_indices, point_values,
+                     point_flags, point_times, not outstation.iin & IIN.NEED_TIME)
+        if selected is None:
+            break
+
+@handler(Function.READ, 60)
+def read_class(outstation, obj, res):
+    # Class 0 is every static point, classes 1-3 drain the event buffers
+    if obj.variation == 1:
+        iin = 0
+        for group in (1, 30, 40):
+            iin |= outstation.handlers[(Function.READ, group)](outstation, obj, res)
+        return iin
+    events = outstation.database.events.get(obj.variation - 1)
+    if events is None:
+        return IIN.OBJECT_UNKNOWN
+    limit = obj.count if obj.ranges in (7, 8) else outstation.max_events
+    limit = min(limit, outstation.max_events)
+    if events.count and limit:
+        read_events(outstation, res, events.drain(limit))
+    return 0
+
+@handler(Function.ENABLE_UNSOLICITED, 60)
+def enable_unsolicited(outstation, obj, res):
+    # Report events of a class 1-3 to the requesting master
+    cls = obj.variation - 1
+    if cls not in outstation.database.events:
+        return IIN.PARAMETER_ERROR
+    outstation.unsolicited.setdefault(outstation.request.link_source, set()).add(cls)
+    outstation.notify()
+    return 0
+
+@handler(Function.DISABLE_UNSOLICITED, 60)
+def disable_unsolicited(outstation, obj, res):
+    cls = obj.variation - 1
+    if cls not in outstation.database.events:
+        return IIN.PARAMETER_ERROR
+    outstation.unsolicited.get(outstation.request.link_source, set()).discard(cls)
+    return 0
+
+@handler(Function.WRITE, 34)
+def write_deadband(outstation, obj, res):
+    # Deadbands of analog inputs; a float one must be a 32bit unsigned
+    table = outstation.database.analog_inputs
+    iin = 0
+    for index, value in zip(obj.index or [], obj.value or []):
+        if index < len(table) and 0 <= value <= 0xffffffff:  # not NaN
+            table.deadbands[index] = int(value)
+        else:
+            iin |= IIN.PARAMETER_ERROR
+    return iin
+
+@handler(Function.WRITE, 50)
+def write_time(outstation, obj, res):
+    # Set the clock to the time written (variation 1), or to the last
+    # recorded time plus the time since RECORD_CURRENT_TIME (variation 3)
+    database = outstation.database
+    now = database.now()
+    if not obj.time:
+        return IIN.PARAMETER_ERROR
+    if obj.variation == 1:
+        t = obj.time[0]
+    elif obj.variation == 3 and outstation.recorded_time is not None:
+        t = obj.time[0] + now - outstation.recorded_time
+        outstation.recorded_time = None
+    else:
+        return IIN.PARAMETER_ERROR
+    database.time_offset += t - now
+    outstation.iin &= ~IIN.NEED_TIME
+    return 0
+
+@handler(Function.DIRECT_OPERATE, 41)
+def operate_analog_out(outstation, obj, res):
+    # 32bit and 16bit commands; the outputs hold integers
+    if obj.variation not in (1, 2):
+        return IIN.OBJECT_UNKNOWN
+    database = outstation.database
+    res.object_header(41, 1, 0x28)  # 32bit value and control status
+    iin = 0
+    indices = obj.index or []
+    res.object_value2(len(indices))
+    for index, value in zip(indices, obj.value or []):
+        status = 0  # success
+        if index < len(database.analog_outputs):
+            database.update('analog_outputs', index, value)
+        else:
+            status = 4  # not supported
+            iin |= IIN.PARAMETER_ERROR
+        res.object_value2(index)
+        res.object_value4(value)
+        res.object_value1(status)
+    return iin
+
+class DnpOutstation(object):
+    '''DNP outstation serving many masters at once
+
+    Each object header of a request is dispatched through self.handlers,
+    a copy of HANDLERS that register() may extend. All sessions share
+    self.database. A class poll returns at most max_events events, the
+    rest stay buffered and are flagged in the IIN. A response holding
+    more than max_fragment bytes is split into application fragments,
+    sent back to back with CON set on all but the last.
+
+    Once a master enabled unsolicited responses for some classes (kept
+    in self.unsolicited by master address), new events of those classes
+    are pushed to it: events arriving within unsolicited_window seconds
+    are sent together, and the response is repeated every
+    confirm_timeout seconds, at most unsolicited_retries times, until
+    the master confirms it. Unconfirmed events stay buffered.
+
+    With need_time, NEED_TIME is set in the IIN until a master sets the
+    clock (WRITE of group 50, after RECORD_CURRENT_TIME for the LAN
+    procedure).
+    '''
+    need_time = False
+    max_events = 512
+    max_fragment = DnpSimple.MAX_FRAGMENT
+    unsolicited_window = 0.05
+    confirm_timeout = 2.0
+    unsolicited_retries = 2
+
+    def __init__(self, address=123, database=None):
+        self.address = address
+        self.database = database if database is not None else DnpPointDatabase()
+        self.handlers = dict(HANDLERS)
+        self.sessions = set()
+        self.iin = IIN.NEED_TIME if self.need_time else 0
+        self.recorded_time = None  # outstation time of RECORD_CURRENT_TIME
+        self.unsolicited = {}  # master address -> event classes
+        self.request = None  # the request being handled
+        self.fragments = []  # objects of its full response fragments
+        self.loop = None
+
+    def register(self, function, group, fn):
+        self.handlers[(function, group)] = fn
+
+    def route(self, req):
+        # The outstation to handle req, None to ignore it
+        return self
+
+    def room(self, res):
+        # Bytes left for objects in the response fragment being built
+        return self.max_fragment - (len(res.data) - (_IIN_OFFSET - 2))  # from application header
+
+    def split(self, res):
+        # Move the objects of res to a fragment of its own
+        self.fragments.append(bytes(res.data[_OBJECTS_OFFSET:]))
+        del res.data[_OBJECTS_OFFSET:]
+
+    def handle(self, req):
+        '''Return the response frames to the DnpDisasm req, or None'''
+        function = req.application_function
+        if function == Function.CONFIRM:
+            return None
+        m = DnpSimple.metrics
+        if m is not None:
+            started = time.perf_counter()
+
+        res = DnpSimple.DnpAsm()
+        res.makePrologue(self.address, req.link_source, Function.RESPONSE,
+                         req.application_seq)
+        res.object_value2(0)  # iin, filled in below
+        # An overflow is reported even if this request drains the buffer
+        iin = self.database.event_iin() & IIN.EVENT_BUFFER_OVERFLOW
+        self.request = req
+        self.fragments = []
+        if function == Function.RECORD_CURRENT_TIME:
+            self.recorded_time = self.database.now()
+        for obj in req.objects:
+            fn = self.handlers.get((function, obj.group))
+            if obj.error:
+                iin |= IIN.PARAMETER_ERROR
+            elif fn is not None:
+                with self.database.lock:
+                    iin |= fn(self, obj, res) or 0
+            elif any(key[0] == function for key in self.handlers):
+                iin |= IIN.OBJECT_UNKNOWN
+            else:
+                iin |= IIN.NO_FUNC_CODE_SUPPORT
+        self.request = None
+        iin |= self.iin | self.database.event_iin()
+        _IIN.pack_into(res.data, _IIN_OFFSET, iin)
+        if self.fragments:
+            data = self.fragmented(req, res, iin)
+        else:
+            res.makeEpilogue()
+            data = res.data
+        if m is not None:
+            m.time('dispatch', time.perf_counter() - started, ('function', function))
+        return data
+
+    def rejected(self, req):
+        # Response to a request that could not be handled
+        self.request = None
+        res = DnpSimple.DnpAsm()
+        res.makePrologue(self.address, req.link_source, Function.RESPONSE,
+                         req.application_seq)
+        res.object_value2(IIN.PARAMETER_ERROR | self.iin | self.database.event_iin())
+        res.makeEpilogue()
+        return res.data
+
+    def fragmented(self, req, res, iin):
+        # Frames of a response in several fragments, each but the last
+        # asking for confirmation, sent back to back
+        fragments = self.fragments + [bytes(res.data[_OBJECTS_OFFSET:])]
+        data = bytearray()
+        last = len(fragments) - 1
+        transport_seq = 0
+        for k, objects in enumerate(fragments):
+            part = DnpSimple.DnpAsm()
+            part.transport_seq = transport_seq
+            part.makePrologue(self.address, req.link_source, Function.RESPONSE,
+                              (req.application_seq + k) & 0x0f, con=int(k < last),
+                              fir=int(k == 0), fin=int(k == last))
+            part.object_value2(iin)
+            part.data += objects
+            part.makeEpilogue()
+            data += part.data
+            transport_seq = part.transport_seq
+        return data
+
+    def unsolicited_response(self, dst, classes, seq):
+        '''Return (frames, marks) of an unsolicited response to dst
+
+        holding the buffered events of classes, or None if there are
+        none. The events stay buffered until release(marks).
+        '''
+        database = self.database
+        with database.lock:
+            pending = [database.events[cls] for cls in sorted(classes)
+                       if database.events[cls].count]
+            if not pending:
+                return None
+            res = DnpSimple.DnpAsm()
+            res.makePrologue(self.address, dst, Function.UNSOLICITED_RESPONSE, seq,
+                             con=1, uns=1)
+            res.object_value2(0)  # iin, filled in below
+            marks = []
+            for events in pending:
+                columns, upto = events.peek(self.max_events)
+                read_events(self, res, columns)
+                marks.append((events, upto))
+            _IIN.pack_into(res.data, _IIN_OFFSET, self.iin | database.event_iin())
+        res.makeEpilogue()
+        return res.data, marks
+
+    def release(self, marks):
+        # Remove the events of a confirmed unsolicited response
+        with self.database.lock:
+            for events, upto in marks:
+                events.release(upto)
+
+    def notify(self, cls=None):
+        # Wake the unsolicited reporting of every session; thread safe
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.wake)
+
+    def wake(self):
+        for session in self.sessions:
+            session.events_ready.set()
+
+    async def serve(self, host='', port=20000):
+        '''Start listening and return the asyncio server'''
+        loop = self.loop = asyncio.get_event_loop()
+        if self.notify not in self.database.listeners:
+            self.database.listeners.append(self.notify)
+        return await loop.create_server(
+            lambda: DnpOutstationProtocol(self), host, port)
+
+class DnpOutstationProtocol(asyncio.BufferedProtocol):
+    '''Session with one master'''
+    def __init__(self, outstation):
+        self.outstation = outstation
+        self.framer = DnpSimple.DnpFramer()
+        self.reassembler = DnpSimple.DnpReassembler(quiet=True, strict=True)
+        self.link = DnpSimple.DnpLink(master=False)
+        self.transport = None
+        self.master = None  # link address, from its requests
+        self.uns_seq = 0
+        self.confirm = None
+        self.events_ready = asyncio.Event()
+        self.reporter = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.outstation.sessions.add(self)
+        self.reporter = asyncio.ensure_future(self.report())
+
+    def connection_lost(self, exc):
+        self.outstation.sessions.discard(self)
+        if self.reporter is not None:
+            self.reporter.cancel()
+
+    def write(self, data):
+        self.transport.write(data)
+        if DnpSimple.metrics is not None:
+            DnpSimple.metrics.sent(data)
+
+    def confirm_received(self, seq):
+        confirm = self.confirm
+        if confirm is not None and not confirm.done() and seq == self.uns_seq:
+            confirm.set_result(seq)
+
+    async def report(self):
+        '''Push unsolicited responses of new events until disconnected'''
+        outstation = self.outstation
+        loop = asyncio.get_event_loop()
+        while True:
+            await self.events_ready.wait()
+            await asyncio.sleep(outstation.unsolicited_window)  # coalesce
+            self.events_ready.clear()
+            classes = outstation.unsolicited.get(self.master)
+            if not classes:
+                continue
+            response = outstation.unsolicited_response(self.master, classes, self.uns_seq)
+            if response is None:
+                continue
+            txdata, marks = response
+            for retry in range(outstation.unsolicited_retries + 1):
+                self.confirm = loop.create_future()
+                self.write(txdata)
+                try:
+                    await asyncio.wait_for(self.confirm, outstation.confirm_timeout)
+                except asyncio.TimeoutError:
+                    continue
+                outstation.release(marks)
+                self.events_ready.set()  # more may have been buffered
+                break
+            self.confirm = None
+            self.uns_seq = (self.uns_seq + 1) & 0x0f
+
+    def get_buffer(self, sizehint):
+        return self.framer.buffer()
+
+    def buffer_updated(self, nbytes):
+        self.framer.commit(nbytes)
+        for frame in self.framer.frames():
+            self.frame_received(frame)
+
+    def frame_received(self, frame):
+        deliver, reply, ack = self.link.receive(frame)
+        if reply is not None:
+            self.write(reply)
+        if not deliver:
+            return
+        try:
+            req = self.reassembler.feed(frame)
+        except (DnpSimple.DnpCrcError, IndexError, ValueError):
+            return  # corrupt or too short to answer
+        if req is None:
+            return
+        outstation = self.outstation.route(req)
+        if outstation is None:
+            return
+        self.master = req.link_source
+        if req.application_function == Function.CONFIRM and req.application_uns:
+            self.confirm_received(req.application_seq)
+            return
+        try:
+            txdata = outstation.handle(req)
+        except (IndexError, ValueError):
+            txdata = outstation.rejected(req)
+        if txdata:
+            self.write(txdata)
+
+async def main(port):
+    outstation = DnpOutstation()
+    server = await outstation.serve(port=port)
+    print('DNP outstation listening on port {}'.format(port))
+    async with server:
+        await server.serve_forever()
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000))
+    except KeyboardInterrupt:
+        pass
+    sys.exit(0)
+
+# Local Variables:
+# compile-command: "python DnpSimpleOutstation.py"
+# End:
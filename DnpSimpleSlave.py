@@ -16,42 +16,42 @@ ao = {}
 try:
     while True:
         # Wait for DNP master
-        print 'DNP slave waiting'
+        print('DNP slave waiting')
         client, address = server.accept()
+        framer = DnpSimple.DnpFramer()
     
-        # Infinite loop for each request
-        while True:
-            # Receive request
-            rxdata = bytearray(client.recv(512))
-            if not rxdata:
-                break;
-            req = DnpSimple.DnpDisasm(rxdata, request=True)
-
-            # Process request
-            fg = (req.application_function, req.objects[0].group)
-            if fg == (5, 41):
-                # AO output
+        # Infinite loop for each received chunk
+        while framer.recv(client):
+            # Process each complete request
+            for rxdata in framer.frames():
+                req = DnpSimple.DnpDisasm(rxdata, request=True)
+
+                fg = (req.application_function, req.objects[0].group)
                 do = req.objects[0].objects[0]
-                print 'AO[{}] = {}'.format(do.index, do.value)
-                ao[do.index] = do.value
-                txdata = DnpSimple.DnpAsm.response_analog_out(
-                    src=0, dst=123, index=0, value=do.value)
-            elif fg == (1, 40):
-                # AO status
-                value = ao.get(do.index, 0)
-                txdata = DnpSimple.DnpAsm.response_analog_out_status(
-                    src=0, dst=123, index=0, value=value)
-            else:
-                raise Error('UNIMPLEMENTED')
-
-            res = DnpSimple.DnpDisasm(txdata)
-            client.send(txdata)
-
-    print 'Client disconnected'
-    client.close()
+                if fg == (5, 41):
+                    # AO output
+                    print('AO[{}] = {}'.format(do.index, do.value))
+                    ao[do.index] = do.value
+                    txdata = DnpSimple.DnpAsm.response_analog_out(
+                        src=0, dst=123, index=0, value=do.value,
+                        seq=req.application_seq)
+                elif fg == (1, 40):
+                    # AO status
+                    value = ao.get(do.index, 0)
+                    txdata = DnpSimple.DnpAsm.response_analog_out_status(
+                        src=0, dst=123, index=0, value=value,
+                        seq=req.application_seq)
+                else:
+                    raise NotImplementedError('UNIMPLEMENTED')
+
+                res = DnpSimple.DnpDisasm(txdata)
+                client.sendall(txdata)
+
+        print('Client disconnected')
+        client.close()
 
 except KeyboardInterrupt:
-    print
+    print('')
     client.close()
     sys.exit(0)
 except:
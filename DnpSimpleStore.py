@@ -0,0 +1,178 @@
+#!/usr/bin/python
+
+# Persistent point store for the outstation
+#     - DnpPointStore: the point tables of a DnpPointDatabase in a
+#       memory-mapped file, so a restarted (or standby) outstation
+#       resumes with the last values, deadbands and event classes, and
+#       other processes can read the live points
+#
+# File layout, in host byte order:
+#     header: magic, byte order ('<' or '>'), count of binary inputs,
+#             analog inputs and analog outputs, padded to 64 bytes
+#     then for each table in that order, its values, flags, classes,
+#     deadbands and reported columns, each aligned to 8 bytes
+
+import DnpSimple
+from DnpSimpleOutstation import DnpOutstation, DnpPointDatabase, DnpPointTable
+import asyncio
+import mmap
+import os
+import struct
+import sys
+import threading
+
+_MAGIC = b'DNPSTORE'
+_HEADER = struct.Struct('=8sc3xIII')
+_HEADER_SIZE = 64
+_ORDER = b'<' if sys.byteorder == 'little' else b'>'
+
+def store_layout(counts):
+    '''Return (size, tables) of a store file with counts points per table
+
+    tables lists, for each table of DnpPointDatabase.tables, the
+    (offset, typecode, count) of each of its columns.
+    '''
+    tables = []
+    offset = _HEADER_SIZE
+    for count, (name, code, group, variation, cls) in zip(counts, DnpPointDatabase.tables):
+        columns = []
+        for column_code in (code, 'B', 'B', 'I', code):  # see DnpPointTable.columns
+            columns.append((offset, column_code, count))
+            offset += (struct.calcsize(column_code) * count + 7) & ~7
+        tables.append(columns)
+    return offset, tables
+
+class DnpPointStore(object):
+    '''Point tables backed by a memory-mapped file
+
+    A new file is created with the default points of a DnpPointDatabase
+    (16 of each type unless given); an existing one is mapped as it is,
+    so reopening costs a map call whatever its size. Its point counts
+    must match those given, if any.
+
+        store = DnpPointStore('points.dat', analog_inputs=100000)
+        outstation = DnpOutstation(123, DnpPointDatabase(store=store))
+
+    The tables (self.binary_inputs, ...) are DnpPointTables whose
+    columns are memoryviews of the mapping, so changes are seen at once
+    by every process mapping the file. A background thread writes them
+    to disk every sync_interval seconds (None for only on sync() and
+    close()). Readers open the file with readonly=True.
+    '''
+    def __init__(self, path, binary_inputs=None, analog_inputs=None, analog_outputs=None,
+                 sync_interval=1.0, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        self.thread = None
+        self.view = None
+        counts = (binary_inputs, analog_inputs, analog_outputs)
+        if not os.path.exists(path):
+            if readonly:
+                raise DnpSimple.DnpError('point store {} does not exist'.format(path))
+            self.create(path, [16 if count is None else count for count in counts])
+
+        self.file = open(path, 'rb' if readonly else 'r+b')
+        self.map = mmap.mmap(self.file.fileno(), 0,
+                             access=mmap.ACCESS_READ if readonly else mmap.ACCESS_WRITE)
+        magic, order, *stored = _HEADER.unpack_from(self.map.read(_HEADER.size).ljust(_HEADER.size))
+        if magic != _MAGIC or order != _ORDER:
+            self.close()
+            raise DnpSimple.DnpError('{} is not a point store of this host'.format(path))
+        size, layout = store_layout(stored)
+        for count, have, (name, code, group, variation, cls) in zip(
+                counts, stored, DnpPointDatabase.tables):
+            if count is not None and count != have:
+                self.close()
+                raise DnpSimple.DnpError('point store {} holds {} {}, not {}'.format(
+                    path, have, name, count))
+        if len(self.map) < size:
+            self.close()
+            raise DnpSimple.DnpError('point store {} is truncated'.format(path))
+
+        self.view = memoryview(self.map)
+        self.views = []
+        for columns, count, (name, code, group, variation, cls) in zip(
+                layout, stored, DnpPointDatabase.tables):
+            views = []
+            for offset, column_code, n in columns:
+                view = self.view[offset:offset + struct.calcsize(column_code) * n]
+                views.append(view.cast(column_code))
+            self.views += views
+            setattr(self, name, DnpPointTable(count, code, group, variation, cls, views))
+
+        self.sync_interval = sync_interval
+        self.stopping = threading.Event()
+        if sync_interval and not readonly:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    @staticmethod
+    def create(path, counts):
+        # Write a new store with default points, replacing path atomically
+        size, layout = store_layout(counts)
+        data = bytearray(size)
+        _HEADER.pack_into(data, 0, _MAGIC, _ORDER, *counts)
+        for columns, count, (name, code, group, variation, cls) in zip(
+                layout, counts, DnpPointDatabase.tables):
+            table = DnpPointTable(count, code, group, variation, cls)
+            for (offset, column_code, n), column in zip(columns, DnpPointTable.columns):
+                raw = getattr(table, column).tobytes()
+                data[offset:offset + len(raw)] = raw
+        temp = path + '.tmp'
+        with open(temp, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, path)
+
+    def run(self):
+        # Sync thread: write changed pages every sync_interval seconds
+        while not self.stopping.wait(self.sync_interval):
+            self.sync()
+
+    def sync(self):
+        '''Write the points to disk now'''
+        if not self.readonly and not self.map.closed:
+            self.map.flush()
+
+    def close(self):
+        if self.thread is not None:
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+        if self.view is not None:
+            self.sync()
+            for view in self.views:
+                view.release()
+            self.view.release()
+            self.view = None
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+async def main(path, port):
+    store = DnpPointStore(path)
+    outstation = DnpOutstation(database=DnpPointDatabase(store=store))
+    await outstation.serve('', port)
+    print('DNP outstation with points in {} listening on port {}'.format(path, port))
+    try:
+        await asyncio.Event().wait()
+    finally:
+        store.close()
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else 'points.dat',
+                         int(sys.argv[2]) if len(sys.argv) > 2 else 20000))
+    except KeyboardInterrupt:
+        pass
+    sys.exit(0)
+
+# Local Variables:
+# compile-command: "python DnpSimpleStore.py points.dat 20000"
+# End:
@@ -0,0 +1,224 @@
+#!/usr/bin/python
+
+# DNP over UDP
+#     - DnpUdpEndpoint: non-blocking UDP socket, one link frame per
+#       datagram, batched receives into a preallocated buffer pool and
+#       batched sends
+#     - DnpUdpMaster, DnpUdpOutstation: the asyncio master and outstation
+#       over UDP, with a session per peer link address
+
+import DnpSimple
+from DnpSimpleAsyncMaster import DnpAsyncMaster, DnpMasterProtocol
+from DnpSimpleOutstation import DnpOutstation, DnpOutstationProtocol
+import asyncio
+import collections
+import socket
+import sys
+
+# Largest link frame: 255 byte link length, CRCs included
+MAX_FRAME = DnpSimple.frame_length(255)
+
+class DnpUdpEndpoint(object):
+    '''Non-blocking UDP socket carrying one link frame per datagram
+
+    When the socket is readable, datagrams are received in a loop into a
+    pool of preallocated buffers until it would block or the pool is
+    used up, like recvmmsg(), then each frame is passed to
+    datagram_received(frame, addr). frame is a memoryview into the
+    pool, valid only during the call.
+
+    send() splits data into its frames and queues one datagram each;
+    the queue is flushed once per event loop iteration, so datagrams
+    sent by many sessions go out in one batch.
+    '''
+    def __init__(self, datagram_received, host='', port=0, pool=64):
+        self.datagram_received = datagram_received
+        self.loop = asyncio.get_event_loop()
+        family = socket.AF_INET6 if ':' in host else socket.AF_INET
+        self.sock = socket.socket(family, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.sock.bind((host, port))
+        self.buffers = [memoryview(bytearray(MAX_FRAME)) for k in range(pool)]
+        self.queue = collections.deque()  # (datagram, addr)
+        self.flushing = False
+        self.writing = False
+        self.received = 0
+        self.sent = 0
+        self.dropped = 0
+        self.loop.add_reader(self.sock.fileno(), self.readable)
+
+    def address(self):
+        return self.sock.getsockname()
+
+    def close(self):
+        if self.sock.fileno() >= 0:
+            self.loop.remove_reader(self.sock.fileno())
+            if self.writing:
+                self.loop.remove_writer(self.sock.fileno())
+            self.sock.close()
+
+    def readable(self):
+        # Receive a batch of datagrams, then handle them
+        batch = []
+        for buffer in self.buffers:
+            try:
+                n, addr = self.sock.recvfrom_into(buffer)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:  # such as an ICMP port unreachable
+                continue
+            batch.append((buffer, n, addr))
+        self.received += len(batch)
+        for buffer, n, addr in batch:
+            if n < 10 or not DnpSimple.verify_frame(buffer[:n]):
+                self.dropped += 1
+                if DnpSimple.metrics is not None:
+                    DnpSimple.metrics.count('crc_errors')
+                continue
+            if DnpSimple.metrics is not None:
+                DnpSimple.metrics.count('frames_received')
+                DnpSimple.metrics.count('bytes_received', n=n)
+            self.datagram_received(buffer[:n], addr)
+
+    def send(self, data, addr):
+        '''Queue the frames of data to addr, one datagram each'''
+        p = 0
+        while p < len(data):
+            n = DnpSimple.frame_length(data[p + 2])
+            self.queue.append((data[p:p + n], addr))
+            p += n
+        if not self.flushing:
+            self.flushing = True
+            self.loop.call_soon(self.flush)
+
+    def flush(self):
+        # Send queued datagrams until the socket would block
+        self.flushing = False
+        queue = self.queue
+        while queue:
+            datagram, addr = queue[0]
+            try:
+                self.sock.sendto(datagram, addr)
+            except (BlockingIOError, InterruptedError):
+                if not self.writing:
+                    self.writing = True
+                    self.loop.add_writer(self.sock.fileno(), self.flush)
+                return
+            except OSError:
+                self.dropped += 1
+            queue.popleft()
+            self.sent += 1
+        if self.writing:
+            self.writing = False
+            self.loop.remove_writer(self.sock.fileno())
+
+class DnpUdpTransport(object):
+    '''Stands in for the asyncio transport of a session with one peer'''
+    def __init__(self, endpoint, addr, protocol):
+        self.endpoint = endpoint
+        self.addr = addr
+        self.protocol = protocol
+
+    def write(self, data):
+        self.endpoint.send(data, self.addr)
+
+    def close(self):
+        self.protocol.connection_lost(None)
+
+def _link_source(frame):
+    return frame[6] | (frame[7] << 8)
+
+class DnpUdpMaster(DnpAsyncMaster):
+    '''DnpAsyncMaster over UDP
+
+    All outstations share one UDP socket bound to host:port (any free
+    port by default); responses are routed to the session of their link
+    source address, and follow the UDP address they come from.
+    '''
+    def __init__(self, address=0, timeout=5.0, host='', port=0, **kwargs):
+        DnpAsyncMaster.__init__(self, address, timeout, **kwargs)
+        self.host = host
+        self.port = port
+        self.endpoint = None
+
+    async def add_outstation(self, addr, host, port=20000, window=None, confirmed=None):
+        if window is None:
+            window = self.window
+        if confirmed is None:
+            confirmed = self.confirmed
+        if self.endpoint is None:
+            self.endpoint = DnpUdpEndpoint(self.datagram_received, self.host, self.port)
+        loop = asyncio.get_event_loop()
+        infos = await loop.getaddrinfo(host, port, family=self.endpoint.sock.family,
+                                       type=socket.SOCK_DGRAM)
+        protocol = DnpMasterProtocol(self, addr, window, confirmed)
+        protocol.connection_made(DnpUdpTransport(self.endpoint, infos[0][4], protocol))
+        self.outstations[addr] = protocol
+        return protocol
+
+    def datagram_received(self, frame, addr):
+        protocol = self.outstations.get(_link_source(frame))
+        if protocol is not None:
+            protocol.transport.addr = addr
+            protocol.frame_received(bytes(frame))  # responses outlive the buffer
+
+    async def close(self):
+        await DnpAsyncMaster.close(self)
+        if self.endpoint is not None:
+            self.endpoint.close()
+            self.endpoint = None
+
+class DnpUdpOutstation(object):
+    '''Serve a DnpOutstation over UDP
+
+    Each master, by link source address, gets its own session (a
+    DnpOutstationProtocol, with unsolicited reporting) whose responses
+    go to the UDP address of its last request.
+    '''
+    def __init__(self, outstation):
+        self.outstation = outstation
+        self.endpoint = None
+        self.sessions = {}  # master link address -> DnpOutstationProtocol
+
+    def serve(self, host='', port=20000):
+        '''Start listening and return the DnpUdpEndpoint'''
+        outstation = self.outstation
+        outstation.loop = asyncio.get_event_loop()
+        if outstation.notify not in outstation.database.listeners:
+            outstation.database.listeners.append(outstation.notify)
+        self.endpoint = DnpUdpEndpoint(self.datagram_received, host, port)
+        return self.endpoint
+
+    def datagram_received(self, frame, addr):
+        src = _link_source(frame)
+        session = self.sessions.get(src)
+        if session is None:
+            session = self.sessions[src] = DnpOutstationProtocol(self.outstation)
+            session.connection_made(DnpUdpTransport(self.endpoint, addr, session))
+        session.transport.addr = addr
+        session.frame_received(frame)
+
+    def close(self):
+        for session in list(self.sessions.values()):
+            session.transport.close()
+        self.sessions.clear()
+        if self.endpoint is not None:
+            self.endpoint.close()
+            self.endpoint = None
+
+async def main(port):
+    server = DnpUdpOutstation(DnpOutstation())
+    server.serve(port=port)
+    print('DNP outstation listening on UDP port {}'.format(port))
+    await asyncio.Event().wait()
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000))
+    except KeyboardInterrupt:
+        pass
+    sys.exit(0)
+
+# Local Variables:
+# compile-command: "python DnpSimpleUdp.py"
+# End:
@@ -0,0 +1,338 @@
+#!/usr/bin/python
+
+# Tests of DnpSimple
+#     python -m unittest test_DnpSimple
+
+import DnpSimple
+from DnpSimple import DnpAsm, Function, IIN, LinkFunction
+import DnpSimpleCapture
+from array import array
+from DnpSimpleOutstation import DnpOutstation
+import math
+import os
+import struct
+import tempfile
+import unittest
+
+def frames(data):
+    # Split back-to-back link frames
+    result = []
+    p = 0
+    while p < len(data):
+        n = DnpSimple.frame_length(data[p + 2])
+        result.append(bytes(data[p:p + n]))
+        p += n
+    return result
+
+def response(values):
+    return DnpAsm.response_analog_in_range(123, 0, 0, values, [1] * len(values))
+
+def raw_response(objects):
+    # Response frame with objects given as bytes
+    res = DnpAsm()
+    res.makePrologue(123, 0, DnpSimple.Function.RESPONSE)
+    res.object_value2(0)
+    res.data += objects
+    res.makeEpilogue()
+    return res.data
+
+def request(function, group, variation, indices, **columns):
+    # Parsed request of one object header with points at indices
+    req = DnpAsm()
+    req.makePrologue(0, 123, function)
+    req.object_points(group, variation, indices=indices, **columns)
+    req.makeEpilogue()
+    return DnpSimple.DnpDisasm(req.data, quiet=True)
+
+def built_response(build):
+    # Parsed response with the objects appended by build(res)
+    res = DnpAsm()
+    res.makePrologue(123, 0, Function.RESPONSE)
+    res.object_value2(0)
+    build(res)
+    res.makeEpilogue()
+    return DnpSimple.DnpDisasm(res.data, quiet=True)
+
+def with_transport(frame, header):
+    # Frame with another transport header, CRC of its first block updated
+    frame = bytearray(frame)
+    frame[10] = header
+    n = min(16, frame[2] - 5)
+    struct.pack_into('<H', frame, 10 + n, DnpSimple.crc16_dnp(frame, 10, 10 + n))
+    return bytes(frame)
+
+class ReassemblerTest(unittest.TestCase):
+    def setUp(self):
+        self.reassembler = DnpSimple.DnpReassembler(quiet=True, strict=True)
+
+    def feed(self, segments):
+        # Feed frames, return the fragments completed
+        results = []
+        for frame in segments:
+            res = self.reassembler.feed(frame)
+            if res is not None:
+                results.append(res)
+        return results
+
+    def assertValues(self, res, values):
+        self.assertEqual(list(res.objects[0].value), values)
+
+    def test_in_order(self):
+        values = list(range(300))
+        segments = frames(response(values))
+        self.assertEqual(len(segments), 7)
+        results = self.feed(segments)
+        self.assertEqual(len(results), 1)
+        self.assertValues(results[0], values)
+
+    def test_out_of_order(self):
+        values = list(range(300))
+        segments = frames(response(values))
+        results = self.feed([segments[0]] + segments[:0:-1])  # FIR, then last to second
+        self.assertEqual(len(results), 1)
+        self.assertValues(results[0], values)
+
+    def test_duplicates(self):
+        values = list(range(300))
+        segments = frames(response(values))
+        results = self.feed([segments[0], segments[0], segments[1], segments[2], segments[1]]
+                            + segments[3:])
+        self.assertEqual(len(results), 1)
+        self.assertValues(results[0], values)
+        self.assertEqual(self.reassembler.duplicates, 2)
+
+    def test_unfinished_fragment_discarded(self):
+        old = list(range(300))
+        new = list(range(1000, 1300))
+        old_segments = frames(response(old))
+        new_segments = frames(response(new))
+        self.assertEqual(self.feed(old_segments[:-1]), [])  # FIN lost
+        self.assertEqual(self.feed(new_segments[:2] + new_segments[3:]), [])  # segment 2 lost
+        results = self.feed([new_segments[2]])
+        self.assertEqual(len(results), 1)
+        self.assertValues(results[0], new)
+
+    def test_too_many_segments(self):
+        values = list(range(3000))
+        segments = frames(response(values))
+        self.assertGreater(len(segments), 32)
+        body = segments[1:-1] * 2
+        long = [segments[0]] + [with_transport(frame, (k + 1) & 0x3f)
+                                for k, frame in enumerate(body)]
+        long.append(with_transport(segments[-1], 0x80 | (len(long) & 0x3f)))
+        self.assertGreater(len(long), DnpSimple.MAX_SEGMENTS)
+        self.assertEqual(self.feed(long), [])
+        self.assertEqual(self.reassembler.dropped, 1)
+        results = self.feed(segments)  # the next fragment is not affected
+        self.assertEqual(len(results), 1)
+        self.assertValues(results[0], values)
+
+    def test_fragment_size_limit(self):
+        with self.assertRaises(DnpSimple.DnpError):
+            response(list(range(4000)))
+
+class CodecTest(unittest.TestCase):
+    def test_signed_analog(self):
+        values = [-5, 0, 7, -2147483648, 2147483647]
+        res = DnpSimple.DnpDisasm(response(values), quiet=True)
+        self.assertEqual(list(res.objects[0].value), values)
+
+    def test_signed_analog_out(self):
+        res = DnpSimple.DnpDisasm(DnpAsm.request_analog_out(0, 123, 1, -5), quiet=True)
+        self.assertEqual(list(res.objects[0].value), [-5])
+
+    def test_inverted_range(self):
+        for variation in (1, 3):
+            data = raw_response(bytes((30, variation, 0x00, 10, 8)) + bytes(20))
+            res = DnpSimple.DnpDisasm(data, quiet=True, strict=True)
+            self.assertEqual(len(res.objects), 1)
+            self.assertIn('Invalid range', res.objects[0].error)
+
+    def test_negative_length(self):
+        reader = DnpSimple.DnpDisasmBase(memoryview(bytes(8)), False, 4, 8)
+        with self.assertRaises(IndexError):
+            reader.get_bytes(-2)
+        with self.assertRaises(IndexError):
+            reader.read_into(bytearray(8), 0, -2)
+        self.assertEqual(reader.pos, 4)
+
+class PackedTest(unittest.TestCase):
+    states = [1, 0, 0, 1, 1, 1, 0, 1, 0, 1, 1, 0, 0, 0, 1, 1, 1]
+
+    def test_pack_unpack(self):
+        for count in (0, 1, 7, 8, 9, 13, 17):
+            values = self.states[:count]
+            data = DnpSimple.pack_bits(values, count)
+            self.assertEqual(len(data), (count + 7) // 8)
+            self.assertEqual(list(DnpSimple.unpack_bits(data, count)), values)
+
+    def test_bit_order(self):
+        self.assertEqual(DnpSimple.pack_bits([1, 0, 0, 0, 0, 0, 0, 0, 0, 1], 10), b'\x01\x02')
+
+    def test_range(self):
+        values = self.states[:13]
+        res = DnpSimple.DnpDisasm(DnpAsm.response_binary_in_packed(123, 0, 5, values),
+                                  quiet=True)
+        obj = res.objects[0]
+        self.assertEqual((obj.group, obj.variation, obj.start, obj.stop), (1, 1, 5, 17))
+        self.assertEqual(list(obj.index), list(range(5, 18)))
+        self.assertEqual(list(obj.value), values)
+
+    def test_output_status(self):
+        values = self.states[:9]
+        res = DnpAsm()
+        res.makePrologue(123, 0, Function.RESPONSE)
+        res.object_value2(0)
+        res.object_points(10, 1, 300, value=values)  # 2-octet start, stop
+        res.makeEpilogue()
+        obj = DnpSimple.DnpDisasm(res.data, quiet=True).objects[0]
+        self.assertEqual((obj.group, obj.variation, obj.start, obj.stop), (10, 1, 300, 308))
+        self.assertEqual(list(obj.value), values)
+
+    def test_count_qualifier(self):
+        values = self.states[:10]
+        data = raw_response(bytes((1, 1, 0x07, 10)) + DnpSimple.pack_bits(values, 10))
+        obj = DnpSimple.DnpDisasm(data, quiet=True).objects[0]
+        self.assertEqual(list(obj.index), list(range(10)))
+        self.assertEqual(list(obj.value), values)
+
+    def test_indices_refused(self):
+        with self.assertRaises(DnpSimple.DnpError):
+            DnpAsm().object_points(1, 1, indices=[1, 2], value=[1, 0])
+
+class TimeTest(unittest.TestCase):
+    times = [0, 1, 1700000000123, 2 ** 48 - 1]
+
+    def test_time_bytes(self):
+        self.assertEqual(bytes(DnpSimple.time_bytes([0x0605040302])),
+                         bytes((2, 3, 4, 5, 6, 0)))
+        self.assertEqual(len(DnpSimple.time_bytes(self.times)), 6 * len(self.times))
+
+    def test_absolute_time(self):
+        res = built_response(lambda res: res.object_points(50, 1, 0, time=self.times))
+        obj = res.objects[0]
+        self.assertEqual((obj.group, obj.variation), (50, 1))
+        self.assertEqual(list(obj.time), self.times)
+
+    def test_relative_time(self):
+        cto = 1700000000000
+        for synchronized, variation in ((True, 1), (False, 2)):
+            def build(res):
+                res.object_cto(cto, synchronized)
+                res.object_points(2, 3, indices=[1, 2], value=[1, 0], flag=[1, 1],
+                                  time=array('H', [0, 0xffff]))
+            res = built_response(build)
+            self.assertEqual((res.objects[0].group, res.objects[0].variation), (51, variation))
+            self.assertEqual(list(res.objects[0].time), [cto])
+            obj = res.objects[1]
+            self.assertEqual(list(obj.value), [1, 0])
+            self.assertEqual(list(obj.time), [cto, cto + 0xffff])
+
+    def test_relative_time_without_cto(self):
+        res = built_response(lambda res: res.object_points(
+            2, 3, indices=[1], value=[1], flag=[1], time=array('H', [250])))
+        self.assertEqual(list(res.objects[0].time), [250])
+
+class CaptureTest(unittest.TestCase):
+    def decode(self, lines):
+        # (points, stats) of a hex-line capture of (direction, frame) lines
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+            for direction, frame in lines:
+                f.write(direction + ' ' + ' '.join('{:02X}'.format(b) for b in frame) + '\n')
+        self.addCleanup(os.unlink, f.name)
+        return DnpSimpleCapture.decode_parallel(f.name, 1)
+
+    def test_malformed_and_link_frames(self):
+        good = response([1, 2, 3])
+        points, stats = self.decode([
+            ('>', DnpAsm.link_frame(0, 123, LinkFunction.RESET_LINK_STATES)),
+            ('<', DnpAsm.link_frame(123, 0, LinkFunction.ACK, 0, 0)),
+            ('<', good),
+            ('<', raw_response(bytes((30, 1, 0x00, 10, 8)) + bytes(20))),  # stop < start
+            ('<', good)])
+        self.assertEqual(stats['frames'], 5)
+        self.assertEqual(stats['malformed'], 1)
+        self.assertEqual(list(points.value), [1, 2, 3] * 2)
+
+class OutstationTest(unittest.TestCase):
+    def setUp(self):
+        self.outstation = DnpOutstation(123)
+
+    def handle(self, req):
+        return DnpSimple.DnpDisasm(self.outstation.handle(req), quiet=True)
+
+    def read(self, req):
+        return self.handle(DnpSimple.DnpDisasm(req.build(0), quiet=True))
+
+    def test_read_binary_in(self):
+        states = PackedTest.states[:16]
+        for index, state in enumerate(states):
+            self.outstation.database.update('binary_inputs', index, state)
+        obj = self.read(DnpSimple.DnpRequest(0, 123).read(1, 1, 3, 11)).objects[0]
+        self.assertEqual((obj.group, obj.variation, obj.start, obj.stop), (1, 1, 3, 11))
+        self.assertEqual(list(obj.value), states[3:12])
+        obj = self.read(DnpSimple.DnpRequest(0, 123).read(1, 1)).objects[0]  # all points
+        self.assertEqual((obj.group, obj.variation), (1, 1))
+        self.assertEqual(list(obj.value), states)
+        obj = self.read(DnpSimple.DnpRequest(0, 123).read(1, 2, 3, 11)).objects[0]
+        self.assertEqual((obj.group, obj.variation), (1, 2))
+        self.assertEqual(list(obj.value), states[3:12])
+
+    def test_class0_binary_with_flag(self):
+        self.outstation.database.update('binary_inputs', 2, 1)
+        res = self.handle(DnpSimple.DnpDisasm(DnpAsm.request_class(0, 123, 0), quiet=True))
+        obj = res.objects[0]
+        self.assertEqual((obj.group, obj.variation), (1, 2))
+        self.assertEqual(obj.value[2], 1)
+
+    def test_relative_time_events(self):
+        database = self.outstation.database
+        database.binary_inputs.event_variation = 3  # with relative time
+        self.outstation.iin |= IIN.NEED_TIME
+        for variation, state in ((2, 1), (1, 0)):  # unsynchronized until the time is set
+            database.update('binary_inputs', 4, state, when=1700000000000 + state)
+            res = self.handle(DnpSimple.DnpDisasm(DnpAsm.request_class(0, 123, 1), quiet=True))
+            cto, events = res.objects
+            self.assertEqual((cto.group, cto.variation), (51, variation))
+            self.assertEqual((events.group, events.variation), (2, 3))
+            self.assertEqual(list(events.value), [state])
+            self.assertEqual(list(events.time), [1700000000000 + state])
+            self.outstation.iin &= ~IIN.NEED_TIME
+
+    def test_write_time(self):
+        self.outstation.iin |= IIN.NEED_TIME
+        t = DnpSimple.dnp_time() - 3600000
+        res = self.handle(DnpSimple.DnpDisasm(DnpAsm.request_time(0, 123, t, variation=1),
+                                              quiet=True))
+        self.assertFalse(res.iin & (IIN.NEED_TIME | IIN.PARAMETER_ERROR))
+        self.assertLess(abs(self.outstation.database.now() - t), 1000)
+
+    def test_last_recorded_time_needs_record(self):
+        res = self.handle(DnpSimple.DnpDisasm(DnpAsm.request_time(0, 123, 0), quiet=True))
+        self.assertTrue(res.iin & IIN.PARAMETER_ERROR)
+        self.handle(DnpSimple.DnpDisasm(DnpAsm.request_record_current_time(0, 123), quiet=True))
+        t = DnpSimple.dnp_time() + 3600000
+        res = self.handle(DnpSimple.DnpDisasm(DnpAsm.request_time(0, 123, t), quiet=True))
+        self.assertFalse(res.iin & IIN.PARAMETER_ERROR)
+        self.assertLess(abs(self.outstation.database.now() - t), 1000)
+
+    def test_float_analog_out_unknown(self):
+        for variation in (3, 4):
+            res = self.handle(request(Function.DIRECT_OPERATE, 41, variation, [1],
+                                      value=[1.5], flag=[0]))
+            self.assertTrue(res.iin & IIN.OBJECT_UNKNOWN)
+        self.assertEqual(self.outstation.database.analog_outputs.values[1], 0)
+
+    def test_float_deadband(self):
+        deadbands = self.outstation.database.analog_inputs.deadbands
+        res = self.handle(request(Function.WRITE, 34, 3, [1, 2, 3],
+                                  value=[25.0, math.nan, -1.0]))
+        self.assertTrue(res.iin & IIN.PARAMETER_ERROR)
+        self.assertEqual(list(deadbands[1:4]), [25, 0, 0])
+
+if __name__ == '__main__':
+    unittest.main()
+
+# Local Variables:
+# compile-command: "python -m unittest test_DnpSimple"
+# End:
@@ -0,0 +1,211 @@
+#!/usr/bin/python
+
+# Tests of the link layer and of DnpSimpleAsyncMaster
+#     python -m unittest test_DnpSimpleAsyncMaster
+
+import DnpSimple
+from DnpSimple import DnpAsm, Function, IIN, LinkFunction
+from DnpSimpleAsyncMaster import DnpAsyncMaster, DnpMasterProtocol
+from DnpSimpleOutstation import DnpOutstation, DnpOutstationProtocol, DnpPointDatabase
+from test_DnpSimple import frames
+import asyncio
+import unittest
+
+class LoopbackTransport(object):
+    '''Passes the frames written by protocol to peer, except dropped ones
+
+    drop(frame) returning True loses the frame. Every frame written is
+    recorded in self.written.
+    '''
+    def __init__(self, protocol, peer, drop=None):
+        self.protocol = protocol
+        self.peer = peer
+        self.drop = drop
+        self.written = []
+
+    def write(self, data):
+        loop = asyncio.get_event_loop()
+        for frame in frames(data):
+            self.written.append(frame)
+            if self.drop is None or not self.drop(frame):
+                loop.call_soon(self.peer.frame_received, frame)
+
+    def close(self):
+        self.protocol.connection_lost(None)
+        self.peer.connection_lost(None)
+
+def link_function(frame):
+    return frame[3] & 0x0f
+
+def is_primary(frame):
+    return bool(frame[3] & (1 << 6))
+
+class LinkTest(unittest.TestCase):
+    def setUp(self):
+        self.master = DnpSimple.DnpLink(0, 123)
+        self.outstation = DnpSimple.DnpLink(master=False)
+        self.request = DnpAsm.request_class(0, 123, 1)
+
+    def test_nack_before_reset(self):
+        deliver, reply, ack = self.outstation.receive(self.master.confirmed(self.request))
+        self.assertFalse(deliver)
+        self.assertEqual(link_function(reply), LinkFunction.NACK)
+        deliver, reply, ack = self.master.receive(reply)
+        self.assertEqual(ack, LinkFunction.NACK)
+
+    def test_repeated_fcb(self):
+        deliver, reply, ack = self.outstation.receive(self.master.reset())
+        self.assertEqual(link_function(reply), LinkFunction.ACK)
+        frame = self.master.confirmed(self.request)
+        deliver, reply, ack = self.outstation.receive(frame)
+        self.assertTrue(deliver)
+        self.assertEqual(link_function(reply), LinkFunction.ACK)
+        deliver, reply, ack = self.outstation.receive(frame)  # ACK lost, repeated
+        self.assertFalse(deliver)
+        self.assertEqual(link_function(reply), LinkFunction.ACK)
+        self.master.acked()
+        deliver, reply, ack = self.outstation.receive(self.master.confirmed(self.request))
+        self.assertTrue(deliver)
+
+class AsyncMasterTest(unittest.IsolatedAsyncioTestCase):
+    async def connect(self, drop_request=None, drop_response=None, database=None, **kwargs):
+        # A DnpMasterProtocol talking to a DnpOutstationProtocol in process
+        self.outstation = DnpOutstation(123, database)
+        for index in range(16):
+            self.outstation.database.update('analog_inputs', index, 1000 + index)
+        self.handled = 0
+        handle = self.outstation.handle
+        def counted(req):
+            self.handled += 1
+            return handle(req)
+        self.outstation.handle = counted
+        kwargs.setdefault('auto_time', False)
+        self.master = DnpAsyncMaster(timeout=1.0, link_timeout=0.05, **kwargs)
+        protocol = DnpMasterProtocol(self.master, 123, self.master.window, self.master.confirmed)
+        session = self.session = DnpOutstationProtocol(self.outstation)
+        self.to_outstation = LoopbackTransport(protocol, session, drop_request)
+        self.to_master = LoopbackTransport(session, protocol, drop_response)
+        protocol.connection_made(self.to_outstation)
+        session.connection_made(self.to_master)
+        self.master.outstations[123] = protocol
+        self.addAsyncCleanup(self.master.close)
+        return protocol
+
+    def request_seqs(self):
+        # Application sequence numbers of the requests written, in order
+        return [frame[11] & 0x0f for frame in self.to_outstation.written
+                if frame[2] > 7 and frame[10] & 0x40]
+
+    async def test_lost_ack_retransmit(self):
+        acks = []
+        def drop_response(frame):
+            # Lose the ACK of the first confirmed user data frame, after
+            # that of the link reset
+            if is_primary(frame):
+                return False
+            acks.append(frame)
+            return len(acks) == 2
+        await self.connect(drop_response=drop_response, confirmed=True)
+        self.assertEqual(await self.master.read_analog_in(123, 3), 1003)
+        self.assertEqual(len(acks), 3)
+        data = [frame for frame in self.to_outstation.written
+                if link_function(frame) == LinkFunction.CONFIRMED_USER_DATA]
+        self.assertEqual(len(data), 2)
+        self.assertEqual(data[0], data[1])  # repeated unchanged
+        self.assertEqual(self.handled, 1)  # but handled once
+        self.assertEqual(await self.master.read_analog_in(123, 4), 1004)
+        self.assertEqual(self.handled, 2)
+
+    async def test_link_timeout(self):
+        def drop_response(frame):
+            return not is_primary(frame)
+        await self.connect(drop_response=drop_response, confirmed=True, link_retries=1)
+        with self.assertRaises(asyncio.TimeoutError):
+            await self.master.read_analog_in(123, 3)
+        resets = [frame for frame in self.to_outstation.written
+                  if link_function(frame) == LinkFunction.RESET_LINK_STATES]
+        self.assertEqual(len(resets), 2)
+        self.assertFalse(self.master.outstations[123].link.ready)
+
+    async def test_window_seq_reuse_after_timeout(self):
+        lost = []
+        def drop_request(frame):
+            # Lose the first request
+            if not lost:
+                lost.append(frame[11] & 0x0f)
+                return True
+            return False
+        protocol = await self.connect(drop_request=drop_request, window=2)
+        stalled = asyncio.ensure_future(self.master.read_analog_in(123, 0, timeout=0.2))
+        await asyncio.sleep(0)
+        seq = lost[0]
+        for k in range(20):  # through every sequence number, but the pending one
+            self.assertEqual(await self.master.read_analog_in(123, k % 16), 1000 + k % 16)
+        self.assertEqual(self.request_seqs()[1:].count(seq), 0)
+        with self.assertRaises(asyncio.TimeoutError):
+            await stalled
+        self.assertEqual(protocol.pending, {})
+        for k in range(16):
+            self.assertEqual(await self.master.read_analog_in(123, k), 1000 + k)
+        self.assertEqual(self.request_seqs()[1:].count(seq), 1)
+
+    async def test_fragmented_response(self):
+        database = DnpPointDatabase(analog_inputs=20000)
+        await self.connect(database=database)
+        for index in range(20000):
+            database.analog_inputs.values[index] = index - 10000
+        res = await self.master.poll_class(123, 0)
+        values = [value for obj in res.objects if obj.group == 30 for value in obj.value]
+        self.assertEqual(values, list(range(-10000, 10000)))
+        responses = [frame for frame in self.to_master.written if frame[10] & 0x40]
+        self.assertGreater(len(responses), 1)
+        self.assertTrue(all(frame[11] & 0x20 for frame in responses[:-1]))  # CON
+        self.assertFalse(responses[-1][11] & 0x20)
+        confirms = [frame for frame in self.to_outstation.written if frame[12] == 0]
+        self.assertEqual(len(confirms), len(responses) - 1)
+        self.assertEqual(await self.master.read_analog_in(123, 5), -9995)
+
+    async def test_malformed_request_keeps_session(self):
+        await self.connect()
+        header_only = DnpAsm()  # CRC valid, a transport header and nothing else
+        header_only.link_header(0, 123)
+        header_only.transport_header(1, 1, 0)
+        header_only.makeEpilogue()
+        self.assertEqual(header_only.data[2], 6)
+        self.session.frame_received(bytes(header_only.data))
+        self.assertEqual(await self.master.read_analog_in(123, 2), 1002)
+        def broken(outstation, obj, res):
+            raise ValueError('broken handler')
+        self.outstation.register(Function.READ, 30, broken)
+        res = await self.master.request(123, lambda seq: DnpAsm.request_analog_in(
+            0, 123, 2, seq=seq))
+        self.assertTrue(res.iin & IIN.PARAMETER_ERROR)
+        self.assertEqual(self.outstation.sessions, {self.session})
+
+    async def test_sync_time(self):
+        await self.connect()
+        self.outstation.iin |= IIN.NEED_TIME
+        self.outstation.database.time_offset = -3600000
+        res = await self.master.sync_time(123)
+        self.assertFalse(res.iin & (IIN.NEED_TIME | IIN.PARAMETER_ERROR))
+        self.assertLess(abs(self.outstation.database.time_offset), 1000)
+        functions = [frame[12] for frame in self.to_outstation.written]
+        self.assertEqual(functions, [Function.RECORD_CURRENT_TIME, Function.WRITE])
+
+    async def test_auto_time(self):
+        protocol = await self.connect(auto_time=True)
+        self.outstation.iin |= IIN.NEED_TIME
+        self.outstation.database.time_offset = 3600000
+        self.assertEqual(await self.master.read_analog_in(123, 1), 1001)
+        self.assertIsNotNone(protocol.time_sync)
+        await protocol.time_sync
+        self.assertFalse(self.outstation.iin & IIN.NEED_TIME)
+        self.assertLess(abs(self.outstation.database.time_offset), 1000)
+        self.assertEqual(self.master.poll_errors, 0)
+
+if __name__ == '__main__':
+    unittest.main()
+
+# Local Variables:
+# compile-command: "python -m unittest test_DnpSimpleAsyncMaster"
+# End: